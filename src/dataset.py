@@ -0,0 +1,172 @@
+"""
+Partitioned dataset of tweets, an optional layout for the data of every source in one place:
+
+    data/dataset
+    ├── date=2023-03-01
+    │   ├── lang=en
+    │   │   ├── source=sample-stream
+    │   │   │   └── 2023-03-01.parquet
+    │   │   └── source=scraping
+    │   │       └── elonmusk_2023-02-01_2023-04-01.parquet
+    │   └── lang=fr
+    │       └── ...
+    └── ...
+
+Partitions follow the Hive convention (key=value directories), so the dataset can also be read by pyarrow, Spark or
+DuckDB. Tweets are partitioned by the UTC date of their timestamp, their lang and the source they were collected from.
+Partitions are pruned from the directory names alone by read_dataset, so "English tweets in March" only opens the files
+of the March English partitions:
+
+    read_dataset('data/dataset', start='2023-03-01', end='2023-03-31', lang='en')
+
+Files of a previous layout are converted with:
+
+    python src/dataset.py --input data/sample-stream --output data/dataset
+"""
+
+# ----------------------------------------------- IMPORTS ----------------------------------------------- #
+
+# External
+import argparse
+import os
+import pandas as pd
+
+# Local
+from storage import FORMATS, read_table, write_table, is_table, list_tables, apply_schema
+
+# ---------------------------------------------- CONSTANTS ---------------------------------------------- #
+
+PARTITION_KEYS = ['date', 'lang', 'source']
+DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'  # Tweets without a date or a lang, as named by Hive and pyarrow
+
+
+# ---------------------------------------------- FUNCTIONS ---------------------------------------------- #
+
+
+def partition_dir(root, date, lang, source):
+    return os.path.join(root, f'date={date}', f'lang={lang}', f'source={source}')
+
+
+def partition_values(df):
+    """
+    Date and lang partitions of every tweet of a table.
+    """
+    dates = pd.to_datetime(df['timestamp'], utc=True, errors='coerce').dt.strftime('%Y-%m-%d')
+    langs = df['lang'] if 'lang' in df.columns else pd.Series(pd.NA, index=df.index)
+    return dates.fillna(DEFAULT_PARTITION), langs.astype(object).fillna(DEFAULT_PARTITION)
+
+
+def write_partitions(df, root, source, name, fmt='parquet'):
+    """
+    Write a table to the partitions of its tweets, one file called name per partition. As in Hive, the partition keys
+    are not stored in the files. Writing the same name again replaces the files, so a source file can be converted
+    several times.
+    Returns the number of partitions written.
+    """
+    dates, langs = partition_values(df)
+    partitions = 0
+    for (date, lang), rows in df.groupby([dates, langs], sort=False):
+        out_dir = partition_dir(root, date, lang, source)
+        os.makedirs(out_dir, exist_ok=True)
+        write_table(rows.drop(columns=PARTITION_KEYS, errors='ignore'), os.path.join(out_dir, name + FORMATS[fmt]))
+        partitions += 1
+    return partitions
+
+
+def parse_partition(path):
+    """
+    Partition values from the key=value directories of a path.
+    """
+    values = {}
+    for part in os.path.normpath(path).split(os.sep):
+        key, sep, value = part.partition('=')
+        if sep and key in PARTITION_KEYS:
+            values[key] = value
+    return values
+
+
+def selected(value, wanted):
+    if wanted is None:
+        return True
+    if isinstance(wanted, str):
+        return value == wanted
+    return value in wanted
+
+
+def dataset_files(root, start=None, end=None, lang=None, source=None):
+    """
+    Files of the partitions matching the filters, with their partition values. Directories are pruned while walking,
+    files of the other partitions are never listed nor opened.
+    start and end are inclusive 'YYYY-MM-DD' dates, lang and source are a value or a list of values. Tweets without a
+    date are only read when neither start nor end is given.
+    """
+    def keep(key, value):
+        if key == 'date':
+            if value == DEFAULT_PARTITION:  # Would sort after every date
+                return start is None and end is None
+            return (start is None or start <= value) and (end is None or value <= end)
+        return selected(value, {'lang': lang, 'source': source}[key])
+
+    files = []
+    for dir_path, dirs, file_names in os.walk(root):
+        dirs[:] = sorted(d for d in dirs
+                         if '=' not in d or d.split('=')[0] not in PARTITION_KEYS or keep(*d.split('=', 1)))
+        values = parse_partition(os.path.relpath(dir_path, root))
+        files += [(os.path.join(dir_path, f), values) for f in sorted(file_names) if is_table(f)]
+    return files
+
+
+def read_dataset(root, start=None, end=None, lang=None, source=None, columns=None):
+    """
+    Read the tweets of the partitions matching the filters (see dataset_files), only the given columns if any.
+    The partition keys can be requested as columns, they are added from the directory names. Columns get the types of
+    storage.SCHEMA whatever the format of the partition files, so tables of several formats concatenate cleanly.
+    """
+    frames = []
+    for fp, values in dataset_files(root, start, end, lang, source):
+        df = apply_schema(read_table(fp, columns=columns, dtype={'tweet_id': str, 'user_id': str}))  # CSV ids as read
+        for key, value in values.items():
+            if columns is None or key in columns:
+                df[key] = None if value == DEFAULT_PARTITION else value
+        frames.append(df)
+
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+# ------------------------------------------------- MAIN ------------------------------------------------- #
+
+
+def main():
+    tables = list_tables(input_)
+    for fp in tables:
+        name = os.path.splitext(os.path.basename(fp))[0]
+        partitions = write_partitions(read_table(fp), output, source, name, fmt)
+        print(f'{fp} -> {partitions} partitions')
+
+    print(f'{len(tables)} files of {source} converted to {output}')
+
+
+# -------------------------------------------------- CLI -------------------------------------------------- #
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert tweet tables to a dataset partitioned by date, lang and '
+                                                 'source.')
+
+    parser.add_argument('--input', '--i', type=str, help='Directory or file', required=True)
+    parser.add_argument('--output', '--o', type=str, help='Root of the dataset', required=True)
+    parser.add_argument('--source', '--s', type=str,
+                        help='Source of the tweets (Default: name of the input directory, e.g. sample-stream)')
+    parser.add_argument('--format', '--f', type=str, choices=list(FORMATS),
+                        help='Format of the partition files (Default: parquet)', default='parquet')
+
+    args = parser.parse_args()
+    input_ = args.input
+    output = args.output
+    source = args.source or os.path.basename(os.path.normpath(input_ if os.path.isdir(input_)
+                                                              else os.path.dirname(os.path.abspath(input_))))
+    fmt = args.format
+
+    main()
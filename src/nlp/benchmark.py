@@ -0,0 +1,340 @@
+"""
+Throughput and latency benchmark of the NLP detections.
+
+Every detection labels the same synthetic corpus of tweets as the detection scripts do (see utils.predict_labels and
+languages.detect_frame): duplicated texts go through the model once, texts under --min-tokens get the neutral label,
+labels come from --cache when given and are broadcast back to every row. Reported per detection: model load time, rows
+per second, texts predicted by the model, p50 / p99 latency of a model call (a batch) and the peak RSS of the process.
+Results can be written to JSON and compared with a previous run.
+
+With --stub the tweetnlp package is replaced by stub models answering after --stub-latency seconds per text, with
+predictions in the format of the real ones. This measures the pipeline itself (deduplication, sorting, batching, label
+conversion) and runs offline without torch. Language detection always uses lingua, its models ship with the package.
+"""
+
+# ----------------------------------------------- IMPORTS ----------------------------------------------- #
+
+# External
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import time
+import types
+import numpy as np
+import pandas as pd
+
+# Local
+from utils import predict_labels, label_cache
+import sentiment
+import emotion
+import irony
+import offensive
+import hateSpeech
+import topic
+import namedEntity
+import languages
+
+# ---------------------------------------------- CONSTANTS ---------------------------------------------- #
+
+# Task name -> (module, function converting a prediction to a label)
+TASKS = {
+    'sentiment': (sentiment, sentiment.to_sentiment),
+    'emotion': (emotion, emotion.to_emotion),
+    'irony': (irony, irony.to_irony),
+    'offensive': (offensive, offensive.to_offensive),
+    'hate': (hateSpeech, hateSpeech.to_hate),
+    'topic': (topic, topic.to_topic),
+    'entity': (namedEntity, namedEntity.to_entity),
+    'lang': (languages, None),
+}
+
+WORDS = ['the', 'a', 'to', 'and', 'is', 'in', 'it', 'you', 'of', 'for', 'on', 'my', 'this', 'that', 'with', 'so',
+         'love', 'hate', 'great', 'bad', 'today', 'never', 'always', 'people', 'time', 'day', 'new', 'good', 'news',
+         'game', 'music', 'vote', 'covid', 'vaccine', 'government', 'football', 'weather', 'coffee', 'happy', 'sad',
+         'London', 'Paris', 'Biden', 'Apple', 'Netflix', '#covid19', '#love', '#news', '@user', 'lol', 'omg',
+         'amazing', 'worst', 'best', 'really', 'cannot', 'wait', 'tonight', 'morning', 'thanks', 'everyone', 'why']
+
+# Labels of the stub models, as returned by the tweetnlp ones
+STUB_LABELS = {
+    'Sentiment': ['negative', 'neutral', 'positive'],
+    'Emotion': ['anger', 'joy', 'optimism', 'sadness'],
+    'Irony': ['non_irony', 'irony'],
+    'Offensive': ['non-offensive', 'offensive'],
+    'Hate': ['non-hate', 'hate'],
+    'topic_classification': ['arts_&_culture', 'business_&_entrepreneurs', 'celebrity_&_pop_culture',
+                             'diaries_&_daily_life', 'family', 'fashion_&_style', 'film_tv_&_video',
+                             'fitness_&_health', 'food_&_dining', 'gaming', 'learning_&_educational', 'music',
+                             'news_&_social_concern', 'other_hobbies', 'relationships', 'science_&_technology',
+                             'sports', 'travel_&_adventure', 'youth_&_student_life'],
+    'NER': ['person', 'location', 'event', 'corporation', 'product', 'group', 'creative_work'],
+}
+
+
+# ----------------------------------------------- CLASSES ----------------------------------------------- #
+
+
+class StubModel:
+    """
+    Stand-in for a tweetnlp classifier answering every text after latency seconds. Predictions have the format of the
+    tweetnlp ones ({'label': label}, a list of labels if multi_label), the label depending on the length of the text.
+    """
+
+    def __init__(self, labels, latency=0.0, multi_label=False):
+        self.id_to_label = {str(i): label for i, label in enumerate(labels)}
+        self.latency = latency
+        self.multi_label = multi_label
+
+    def prediction(self, text):
+        label = self.id_to_label[str(len(text) % len(self.id_to_label))]
+        if self.multi_label:
+            return {'label': [label] if len(text) % 3 else []}
+        return {'label': label}
+
+    def predict(self, texts, batch_size=None, **kwargs):
+        if isinstance(texts, str):
+            return self.predict([texts], **kwargs)[0]
+        if self.latency:
+            time.sleep(self.latency * len(texts))
+        return [self.prediction(text) for text in texts]
+
+
+class StubNER(StubModel):
+    """
+    Stand-in for the tweetnlp NER model, capitalized words are entities.
+    """
+
+    def prediction(self, text, return_probability=False):
+        entities = []
+        for word in text.split():
+            if word[:1].isupper():
+                entity = {'type': self.id_to_label[str(len(word) % len(self.id_to_label))], 'entity': word}
+                entities.append({**entity, 'probability': 0.9} if return_probability else entity)
+        return entities
+
+    def predict(self, texts, batch_size=None, return_probability=False, **kwargs):
+        if isinstance(texts, str):
+            return self.predict([texts], return_probability=return_probability)[0]
+        if self.latency:
+            time.sleep(self.latency * len(texts))
+        return [self.prediction(text, return_probability) for text in texts]
+
+
+class Timed:
+    """
+    Stand-in for a model (or language detector) recording the latency and the number of texts of every call of
+    method, other attributes are the ones of the model.
+    """
+
+    def __init__(self, model, method):
+        self.model = model
+        self.method = method
+        self.latencies = []
+        self.texts = 0
+
+    def __getattr__(self, name):
+        attribute = getattr(self.model, name)
+        if name != self.method:
+            return attribute
+
+        def timed(texts, *args, **kwargs):
+            start = time.perf_counter()
+            result = attribute(texts, *args, **kwargs)
+            self.latencies.append(time.perf_counter() - start)
+            self.texts += 1 if isinstance(texts, str) else len(texts)
+            return result
+
+        return timed
+
+
+# ---------------------------------------------- FUNCTIONS ---------------------------------------------- #
+
+
+def synthetic_corpus(rows, mean_tokens, max_tokens, duplicates, seed=0):
+    """
+    rows random tweets, token counts drawn from a geometric distribution of mean mean_tokens capped at max_tokens
+    (tweets are mostly short with a long tail), a fraction duplicates of the rows repeat an earlier tweet (retweets).
+    """
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    lengths = np.minimum(np_rng.geometric(1 / mean_tokens, rows), max_tokens)
+
+    texts = []
+    for length in lengths:
+        if texts and rng.random() < duplicates:
+            texts.append(rng.choice(texts))
+        else:
+            texts.append(' '.join(rng.choices(WORDS, k=int(length))))
+
+    return texts
+
+
+def stub_tweetnlp(latency):
+    """
+    Stand-in for the tweetnlp package, its models are stubs (see StubModel) loaded by the load_model of every task.
+    """
+    def classifier(name, multi_label=False):
+        return lambda *args, **kwargs: StubModel(STUB_LABELS[name], latency, multi_label)
+
+    package = types.ModuleType('tweetnlp')
+    for name in ['Sentiment', 'Emotion', 'Irony', 'Offensive', 'Hate']:
+        setattr(package, name, classifier(name))
+    package.NER = lambda *args, **kwargs: StubNER(STUB_LABELS['NER'], latency)
+    package.load_model = lambda task, *args, **kwargs: classifier(task, multi_label=True)()
+    return package
+
+
+def percentile_ms(latencies, q):
+    return round(float(np.percentile(latencies, q)) * 1000, 2) if latencies else None  # Every text cached or short
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of the process so far, in MB (ru_maxrss is in KB on Linux and in bytes on macOS).
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 ** 2 if platform.system() == 'Darwin' else rss / 1024
+
+
+def load(task):
+    """
+    Model (or language detector) of task, timed (see Timed), and its load time in seconds.
+    """
+    module = TASKS[task][0]
+    start = time.perf_counter()
+    if task == 'lang':
+        detector = module.LanguageDetectorBuilder.from_languages(*module.LANGUAGES) \
+            .with_preloaded_language_models().build()  # Counted in the load time, not in the first batch
+        method = 'compute_language_confidence_values_in_parallel' \
+            if hasattr(detector, 'compute_language_confidence_values_in_parallel') \
+            else 'compute_language_confidence_values'
+        module.detector = model = Timed(detector, method)
+        module.threads = os.cpu_count()
+        module.min_tokens = args.min_tokens
+    else:
+        model = Timed(module.load_model('torch' if stub else args.backend), 'predict')
+
+    return model, time.perf_counter() - start
+
+
+def benchmark(task, texts):
+    model, load_time = load(task)
+    module, to_label = TASKS[task]
+    cache = None
+
+    start = time.perf_counter()
+    if task == 'lang':
+        languages.detect_frame(pd.DataFrame({'text': texts}))
+    else:  # Stub labels are cached apart from the ones of the real models
+        cache = label_cache(args, f'{module.MODEL_NAME}-stub' if stub else module.MODEL_NAME)
+        predict_labels(model, texts, to_label, batch_size, cache, min_tokens=args.min_tokens,
+                       neutral=module.NEUTRAL_LABEL)
+    elapsed = time.perf_counter() - start
+
+    if cache is not None:
+        print(cache.stats())
+        cache.close()
+
+    return {
+        'rows': len(texts),
+        'seconds': round(elapsed, 4),
+        'rows_per_sec': round(len(texts) / elapsed, 1),
+        'predicted': model.texts,  # Texts that went through the model, once deduplicated, short and cached removed
+        'batch_p50_ms': percentile_ms(model.latencies, 50),
+        'batch_p99_ms': percentile_ms(model.latencies, 99),
+        'load_seconds': round(load_time, 4),
+        'peak_rss_mb': round(peak_rss_mb(), 1),  # Of the process, includes the models of the previous tasks
+    }
+
+
+def compare(results, baseline_fp):
+    """
+    Print the throughput of every task relative to a previous JSON output.
+    """
+    with open(baseline_fp) as f:
+        baseline = json.load(f)['results']
+
+    for task, result in results.items():
+        if task in baseline:
+            ratio = result['rows_per_sec'] / baseline[task]['rows_per_sec']
+            print(f'{task}: {ratio:.2f}x rows/sec, p99 {baseline[task]["batch_p99_ms"]} -> '
+                  f'{result["batch_p99_ms"]} ms')
+
+
+# ------------------------------------------------- MAIN ------------------------------------------------- #
+
+
+def main():
+    texts = synthetic_corpus(rows, mean_tokens, max_tokens, duplicates, seed)
+    print(f'Benchmark on {len(texts)} synthetic tweets ({"stub models" if stub else args.backend})...')
+    if stub:
+        sys.modules['tweetnlp'] = stub_tweetnlp(stub_latency)  # Imported by the load_model of the tasks
+
+    results = {}
+    for task in tasks:
+        print(f'{task}...')
+        results[task] = benchmark(task, texts)
+        print(', '.join(f'{k}: {v}' for k, v in results[task].items()))
+
+    if output:
+        config = {'rows': rows, 'mean_tokens': mean_tokens, 'max_tokens': max_tokens, 'duplicates': duplicates,
+                  'seed': seed, 'batch_size': batch_size, 'min_tokens': args.min_tokens, 'cache': args.cache,
+                  'backend': args.backend, 'stub': stub, 'stub_latency': stub_latency, 'cpus': os.cpu_count(),
+                  'python': platform.python_version()}
+        with open(output, 'w') as f:
+            json.dump({'config': config, 'results': results}, f, indent=2)
+        print(f'Results written to {output}')
+
+    if baseline:
+        compare(results, baseline)
+
+
+# -------------------------------------------------- CLI -------------------------------------------------- #
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the NLP detections on a synthetic tweet corpus.')
+
+    parser.add_argument('--tasks', '--t', type=str, nargs='+', choices=list(TASKS), default=list(TASKS),
+                        help='Detections to benchmark (Default: all)')
+    parser.add_argument('--rows', '--r', type=int, help='Number of synthetic tweets (Default: 10000)', default=10_000)
+    parser.add_argument('--mean-tokens', '--mn', type=float, help='Mean tokens per tweet (Default: 15)', default=15)
+    parser.add_argument('--max-tokens', '--mx', type=int, help='Maximum tokens per tweet (Default: 60)', default=60)
+    parser.add_argument('--duplicates', '--d', type=float, help='Fraction of repeated tweets (Default: 0.2)',
+                        default=0.2)
+    parser.add_argument('--seed', '--s', type=int, help='Seed of the synthetic corpus (Default: 0)', default=0)
+    parser.add_argument('--batch-size', '--bs', type=int, help='Number of tweets per forward pass (Default: 32)',
+                        default=32)
+    parser.add_argument('--min-tokens', '--mt', type=int, default=0,
+                        help='Texts with fewer tokens get a neutral label without running the model (Default: 0, off)')
+    parser.add_argument('--cache', '--c', type=str, help='SQLite file caching labels across runs (Default: no cache)',
+                        default=None)
+    parser.add_argument('--cache-size', '--cs', type=int, help='Maximum number of cached labels (Default: 5000000)',
+                        default=5_000_000)
+    parser.add_argument('--backend', '--be', type=str, choices=['torch', 'onnx'], default='torch',
+                        help='Inference backend, onnx runs a quantized int8 export on CPU (Default: torch)')
+    parser.add_argument('--stub', '--st', action=argparse.BooleanOptionalAction, default=False,
+                        help='Replace the tweetnlp models by a stub, runs offline without torch (Default: False)')
+    parser.add_argument('--stub-latency', '--sl', type=float, help='Seconds per text of the stub (Default: 0)',
+                        default=0.0)
+    parser.add_argument('--output', '--o', type=str, help='JSON file to write the results to', default=None)
+    parser.add_argument('--baseline', '--b', type=str, help='JSON output of a previous run to compare with',
+                        default=None)
+
+    args = parser.parse_args()
+    tasks = args.tasks
+    rows = args.rows
+    mean_tokens = args.mean_tokens
+    max_tokens = args.max_tokens
+    duplicates = args.duplicates
+    seed = args.seed
+    batch_size = args.batch_size
+    stub = args.stub
+    stub_latency = args.stub_latency
+    output = args.output
+    baseline = args.baseline
+
+    main()
@@ -0,0 +1,119 @@
+"""
+Persistent cache of NLP labels shared by all the detection scripts.
+
+Labels are stored in a SQLite database keyed by the model name, the model version and the hash of the normalized text,
+so reruns (--force) and overlapping datasets only run the model on texts never seen before. The least recently used
+entries are evicted once the cache holds more than max_size labels.
+"""
+
+# ----------------------------------------------- IMPORTS ----------------------------------------------- #
+
+# External
+import hashlib
+import json
+import sqlite3
+import time
+from importlib.metadata import version, PackageNotFoundError
+
+# ---------------------------------------------- CONSTANTS ---------------------------------------------- #
+
+SQL_VARIABLES = 500  # Number of hashes per SELECT, below the SQLite limit on host parameters
+
+
+# ---------------------------------------------- FUNCTIONS ---------------------------------------------- #
+
+
+def normalize(text):
+    return ' '.join(text.split())
+
+
+def text_hash(text):
+    return hashlib.sha1(normalize(text).encode('utf-8')).hexdigest()
+
+
+def tweetnlp_version():
+    """
+    Version of tweetnlp, which pins the default checkpoint of every model.
+    """
+    try:
+        return version('tweetnlp')
+    except PackageNotFoundError:
+        return 'unknown'
+
+
+# ----------------------------------------------- CLASSES ----------------------------------------------- #
+
+
+class LabelCache:
+
+    def __init__(self, path, model_name, backend='torch', model_version=None, max_size=5_000_000):
+        # Labels of other backends (e.g. quantized ONNX) may differ, they are cached apart
+        self.model_name = model_name if backend == 'torch' else f'{model_name}-{backend}'
+        self.model_version = model_version or tweetnlp_version()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS labels (model TEXT, version TEXT, hash TEXT, label TEXT, '
+                          'last_used REAL, PRIMARY KEY (model, version, hash))')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS labels_last_used ON labels (last_used)')
+
+        # Number of labels kept up to date by triggers, so that evict does not count the whole table at every put
+        self.conn.execute('CREATE TABLE IF NOT EXISTS labels_size (n INTEGER)')
+        if self.conn.execute('SELECT COUNT(*) FROM labels_size').fetchone()[0] == 0:  # New file or older cache
+            self.conn.execute('INSERT INTO labels_size SELECT COUNT(*) FROM labels')
+        self.conn.execute('CREATE TRIGGER IF NOT EXISTS labels_insert AFTER INSERT ON labels '
+                          'BEGIN UPDATE labels_size SET n = n + 1; END')
+        self.conn.execute('CREATE TRIGGER IF NOT EXISTS labels_delete AFTER DELETE ON labels '
+                          'BEGIN UPDATE labels_size SET n = n - 1; END')
+        self.conn.commit()
+
+    def get(self, texts):
+        """
+        Cached labels of texts, None for the texts that are not in the cache.
+        """
+        hashes = [text_hash(text) for text in texts]
+        unique = list(set(hashes))
+
+        found = {}
+        for i in range(0, len(unique), SQL_VARIABLES):
+            chunk = unique[i:i + SQL_VARIABLES]
+            rows = self.conn.execute(f'SELECT hash, label FROM labels WHERE model = ? AND version = ? '
+                                     f'AND hash IN ({", ".join("?" * len(chunk))})',
+                                     (self.model_name, self.model_version, *chunk))
+            found.update((h, json.loads(label)) for h, label in rows)
+
+        now = time.time()
+        self.conn.executemany('UPDATE labels SET last_used = ? WHERE model = ? AND version = ? AND hash = ?',
+                              [(now, self.model_name, self.model_version, h) for h in found])
+        self.conn.commit()
+
+        labels = [found.get(h) for h in hashes]
+        hits = sum(label is not None for label in labels)
+        self.hits += hits
+        self.misses += len(labels) - hits
+        return labels
+
+    def put(self, texts, labels):
+        now = time.time()
+        self.conn.executemany('INSERT INTO labels VALUES (?, ?, ?, ?, ?) ON CONFLICT (model, version, hash) '
+                              'DO UPDATE SET label = excluded.label, last_used = excluded.last_used',
+                              [(self.model_name, self.model_version, text_hash(text), json.dumps(label), now)
+                               for text, label in zip(texts, labels)])
+        self.evict()
+        self.conn.commit()
+
+    def evict(self):
+        size = self.conn.execute('SELECT n FROM labels_size').fetchone()[0]
+        if size > self.max_size:
+            self.conn.execute('DELETE FROM labels WHERE rowid IN '
+                              '(SELECT rowid FROM labels ORDER BY last_used LIMIT ?)', (size - self.max_size,))
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0
+        return f'Cache: {self.hits} hits, {self.misses} misses ({rate:.1%} hit rate)'
+
+    def close(self):
+        self.conn.close()
@@ -12,52 +12,41 @@ Association for Computational Linguistics.
 
 # External
 import argparse
-import pandas as pd
-import os
-from tqdm import tqdm
-import tweetnlp
 
+# Local
+from utils import set_backend, add_detection_arguments, parse_detection_arguments, run_detection
 
-# ---------------------------------------------- FUNCTIONS ---------------------------------------------- #
-
+# ---------------------------------------------- CONSTANTS ---------------------------------------------- #
 
-def detect_emotion(text):
-    topic = model.predict(text)
+MODEL_NAME = 'emotion'  # Key of the model in the label cache
+NEUTRAL_LABEL = -1  # No emotion, label of the texts too short to go through the model (see --min-tokens)
 
-    return label_to_id[topic['label']]
 
+# ---------------------------------------------- FUNCTIONS ---------------------------------------------- #
 
-def process_file(fp):
-    df = pd.read_csv(fp)
 
-    if 'emotion' in df.columns and not force:
-        if df['emotion'].isnull().sum() == 0:
-            print('Already detected')
-            return
+def load_model(backend='torch'):
+    global model, label_to_id
+    import tweetnlp  # Imported on first use, it pulls torch and transformers
 
-    df['text'] = df['text'].astype(str)  # Avoids errors in the detection
-    tqdm.pandas()
-    df['emotion'] = df['text'].progress_apply(detect_emotion)
+    model = tweetnlp.Emotion()
+    set_backend(model, MODEL_NAME, backend)
 
-    df.to_csv(fp, index=False)
+    label_to_id = {v: k for k, v in model.id_to_label.items()}
+    # 0 - anger
+    # 1 - joy
+    # 2 - optimism
+    # 3 - sadness
 
+    return model
 
-# ------------------------------------------------- MAIN ------------------------------------------------- #
 
+def to_emotion(topic):
+    return label_to_id[topic['label']]
 
-def main():
-    print(f'Emotion detection on {input_}...')
 
-    if os.path.isfile(input_):  # Single file
-        fp = input_
-        process_file(fp)
-    else:
-        for root, dirs, files in os.walk(input_):
-            for file in files:
-                if file.endswith(".csv"):
-                    print(file)
-                    fp = os.path.join(root, file)
-                    process_file(fp)
+def detect_emotion(text):
+    return to_emotion(model.predict(text))
 
 
 # -------------------------------------------------- CLI -------------------------------------------------- #
@@ -65,20 +54,8 @@ def main():
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Apply NLP Emotion detection to a CSV file.')
+    add_detection_arguments(parser)
 
-    parser.add_argument('--input', '--i', type=str, help='Directory or CSV File', required=True)
-    parser.add_argument('--force', '--fo', action=argparse.BooleanOptionalAction, help='Force detection', default=False)
-
-    args = parser.parse_args()
-    input_ = args.input
-    force = args.force
-
-    model = tweetnlp.Emotion()
-
-    label_to_id = {v: k for k, v in model.id_to_label.items()}
-    # 0 - anger
-    # 1 - joy
-    # 2 - optimism
-    # 3 - sadness
+    args = parse_detection_arguments(parser)
 
-    main()
+    run_detection(args, 'Emotion', 'emotion', MODEL_NAME, load_model, to_emotion, NEUTRAL_LABEL)
@@ -12,55 +12,37 @@ Association for Computational Linguistics.
 
 # External
 import argparse
-import pandas as pd
-import os
-from tqdm import tqdm
-import tweetnlp
 
+# Local
+from utils import set_backend, add_detection_arguments, parse_detection_arguments, run_detection
 
-# ---------------------------------------------- FUNCTIONS ---------------------------------------------- #
-
-
-def detect_hate(text):
-    topic = model.predict(text)
-
-    if topic['label'] == 'hate':
-        return 1
-    else:
-        return 0
+# ---------------------------------------------- CONSTANTS ---------------------------------------------- #
 
+MODEL_NAME = 'hate'  # Key of the model in the label cache
+NEUTRAL_LABEL = 0  # Not hateful, label of the texts too short to go through the model (see --min-tokens)
 
-def process_file(fp):
-    df = pd.read_csv(fp)
 
-    if 'hate' in df.columns and not force:
-        if df['hate'].isnull().sum() == 0:
-            print('Already detected')
-            return
+# ---------------------------------------------- FUNCTIONS ---------------------------------------------- #
 
-    df['text'] = df['text'].astype(str)  # Avoids errors in the detection
-    tqdm.pandas()
-    df['hate'] = df['text'].progress_apply(detect_hate)
 
-    df.to_csv(fp, index=False)
+def load_model(backend='torch'):
+    global model
+    import tweetnlp  # Imported on first use, it pulls torch and transformers
 
+    model = tweetnlp.Hate()
+    set_backend(model, MODEL_NAME, backend)
+    return model
 
-# ------------------------------------------------- MAIN ------------------------------------------------- #
 
+def to_hate(topic):
+    if topic['label'] == 'hate':
+        return 1
+    else:
+        return 0
 
-def main():
-    print(f'Hate Speech detection on {input_}...')
 
-    if os.path.isfile(input_):  # Single file
-        fp = input_
-        process_file(fp)
-    else:
-        for root, dirs, files in os.walk(input_):
-            for file in files:
-                if file.endswith(".csv"):
-                    print(file)
-                    fp = os.path.join(root, file)
-                    process_file(fp)
+def detect_hate(text):
+    return to_hate(model.predict(text))
 
 
 # -------------------------------------------------- CLI -------------------------------------------------- #
@@ -68,14 +50,8 @@ def main():
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Apply NLP Hate Speech detection to a CSV file.')
+    add_detection_arguments(parser)
 
-    parser.add_argument('--input', '--i', type=str, help='Directory or CSV File', required=True)
-    parser.add_argument('--force', '--fo', action=argparse.BooleanOptionalAction, help='Force detection', default=False)
-
-    args = parser.parse_args()
-    input_ = args.input
-    force = args.force
-
-    model = tweetnlp.Hate()
+    args = parse_detection_arguments(parser)
 
-    main()
+    run_detection(args, 'Hate Speech', 'hate', MODEL_NAME, load_model, to_hate, NEUTRAL_LABEL)
@@ -12,42 +12,78 @@ Association for Computational Linguistics.
 
 # External
 import argparse
-import pandas as pd
 import os
+from concurrent.futures import ThreadPoolExecutor
 from lingua import Language, LanguageDetectorBuilder
 from tqdm import tqdm
 
+# Local
+from utils import unique_texts, fan_out, short_texts, list_tables, read_table, write_table, is_labelled
+
 # ---------------------------------------------- CONSTANTS ---------------------------------------------- #
 
 # List of languages to use for detection (can be changed)
 LANGUAGES = [Language.ENGLISH, Language.FRENCH, Language.GERMAN, Language.ITALIAN, Language.SPANISH]
 
+MIN_CONFIDENCE = 0.90  # Below this confidence the language is undefined ('und')
+CHUNK_SIZE = 10_000  # Texts sent to the detector at once
+
 
 # ---------------------------------------------- FUNCTIONS ---------------------------------------------- #
 
 
-def detect_language(text):
-    result = detector.detect_language_of(text)
-    if result:
-        conf = detector.compute_language_confidence(text, result)
-        if conf > 0.90:
-            return result.iso_code_639_1.name.lower()
+def to_language(confidence_values):
+    """
+    Language with the highest confidence if above MIN_CONFIDENCE, 'und' otherwise.
+    Confidence values are sorted by decreasing confidence, as (language, value) tuples in older lingua versions.
+    """
+    if confidence_values:
+        top = confidence_values[0]
+        language, value = (top.language, top.value) if hasattr(top, 'language') else top
+        if value > MIN_CONFIDENCE:
+            return language.iso_code_639_1.name.lower()
     return 'und'
 
 
-def process_file(fp):
-    df = pd.read_csv(fp)
+def detect_language(text):
+    return to_language(detector.compute_language_confidence_values(text))
+
+
+def detect_languages(texts):
+    """
+    Languages of a list of texts, each text is scored once and the texts are spread over threads.
+    """
+    if hasattr(detector, 'compute_language_confidence_values_in_parallel'):  # lingua >= 2.0, native threads
+        os.environ['RAYON_NUM_THREADS'] = str(threads)  # Read once, when the first detection starts the thread pool
+        values = detector.compute_language_confidence_values_in_parallel(texts)
+    else:
+        with ThreadPoolExecutor(threads) as executor:
+            values = list(executor.map(detector.compute_language_confidence_values, texts))
+
+    return [to_language(v) for v in values]
 
-    if 'lang' in df.columns:
-        if df['lang'].isnull().sum() == 0:
-            print('Already detected')
-            return
 
+def detect_frame(df):
     df['text'] = df['text'].astype(str)  # Avoids errors in the detection
-    tqdm.pandas()
-    df['lang'] = df['text'].progress_apply(detect_language)
+    texts, codes = unique_texts(df['text'].tolist())
+    short = set(short_texts(texts, min_tokens)) if min_tokens else set()
+    kept = [text for i, text in enumerate(texts) if i not in short]  # Short texts are 'und' without detection
 
-    df.to_csv(fp, index=False)
+    detected = []
+    for i in tqdm(range(0, len(kept), CHUNK_SIZE)):
+        detected += detect_languages(kept[i:i + CHUNK_SIZE])
+    detected = iter(detected)
+    languages = ['und' if i in short else next(detected) for i in range(len(texts))]
+    df['lang'] = fan_out(languages, codes)
+    return df
+
+
+def process_file(fp):
+    if not force and is_labelled(fp, 'lang'):  # Only the lang column is read
+        print('Already detected')
+        return
+
+    write_table(detect_frame(read_table(fp)), fp)
 
 
 # ------------------------------------------------- MAIN ------------------------------------------------- #
@@ -56,16 +92,9 @@ def process_file(fp):
 def main():
     print(f'Language detection on {input_}...')
 
-    if os.path.isfile(input_):  # Single file
-        fp = input_
+    for fp in list_tables(input_):
+        print(os.path.basename(fp))
         process_file(fp)
-    else:
-        for root, dirs, files in os.walk(input_):  # Directory
-            for file in files:
-                if file.endswith(".csv"):
-                    print(file)
-                    fp = os.path.join(root, file)
-                    process_file(fp)
 
 
 # -------------------------------------------------- CLI -------------------------------------------------- #
@@ -74,16 +103,23 @@ def main():
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Apply NLP language detection to a CSV file.')
 
-    parser.add_argument('--input', '--i', type=str, help='Directory or CSV File', required=True)
+    parser.add_argument('--input', '--i', type=str, help='Directory or file (CSV, Parquet or Feather)', required=True)
     parser.add_argument('--fast', '--fa', action=argparse.BooleanOptionalAction, help='Use fast language detection',
                         default=False)
     parser.add_argument('--force', '--fo', action=argparse.BooleanOptionalAction, help='Force detection', default=False)
+    parser.add_argument('--threads', '--t', type=int,
+                        help='Number of threads (Default: number of CPUs, set by the first detection with lingua >= 2)',
+                        default=os.cpu_count())
+    parser.add_argument('--min-tokens', '--mt', type=int, default=0,
+                        help='Texts with fewer tokens are \'und\' without running the detector (Default: 0, off)')
 
     args = parser.parse_args()
 
     input_ = args.input
     fast = args.fast
     force = args.force
+    threads = args.threads
+    min_tokens = args.min_tokens
 
     if fast:
         print('Using fast language detection')
@@ -12,22 +12,44 @@ Association for Computational Linguistics.
 
 # External
 import argparse
+from functools import partial
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import os
-from tqdm import tqdm
-import tweetnlp
+
+# Local
+from utils import LazyModel, set_backend, predict_labels, process_file_chunked, list_tables, \
+    process_files_parallel, read_table, write_table, file_format, add_detection_arguments, parse_detection_arguments, \
+    label_cache, ENTITY_SUFFIX
 
 # ----------------------------------------------- GLOBALS ----------------------------------------------- #
 
 types = {'person', 'location', 'event', 'corporation', 'product'}
 
+MODEL_NAME = 'entity'  # Key of the model in the label cache
+NEUTRAL_LABEL = {}  # No entity, label of the texts too short to go through the model (see --min-tokens)
+
+# Long format, one row per entity. start and end locate the entity in the text, a repeated entity at each of its
+# occurrences in turn, -1 if tweetnlp normalized it away
+ENTITY_SCHEMA = pa.schema([('tweet_id', pa.int64()), ('type', pa.dictionary(pa.int8(), pa.string())),
+                           ('entity', pa.string()), ('start', pa.int32()), ('end', pa.int32()),
+                           ('score', pa.float32())])
+
 
 # ---------------------------------------------- FUNCTIONS ---------------------------------------------- #
 
 
-def detect_entity(text):
-    result = model.predict(text)
+def load_model(backend='torch'):
+    global model
+    import tweetnlp  # Imported on first use, it pulls torch and transformers
 
+    model = tweetnlp.NER()
+    set_backend(model, MODEL_NAME, backend)
+    return model
+
+
+def to_entity(result):
     res = {}
     for r in result:
         if r['type'] in types:
@@ -35,15 +57,95 @@ def detect_entity(text):
 
     return res
 
-def process_file(fp):
-    df = pd.read_csv(fp)
 
+def to_entity_list(result):
+    return [(r['type'], r['entity'], r.get('probability')) for r in result]
+
+
+def detect_entity(text):
+    return to_entity(model.predict(text))
+
+
+def entity_table(df, labels):
+    """
+    Long format table of the entities of df (see ENTITY_SCHEMA), labels coming from to_entity_list.
+    """
+    rows = []
+    tweet_ids = pd.to_numeric(df['tweet_id'], errors='coerce').astype('Int64')
+    for tweet_id, text, entities in zip(tweet_ids, df['text'], labels):
+        ends = {}  # Entity -> end of its last occurrence, entities come in the order of the text
+        for type_, entity, score in entities:
+            start = text.find(entity, ends.get(entity, 0))
+            if start >= 0:
+                ends[entity] = start + len(entity)
+            rows.append((tweet_id, type_, entity, start, start + len(entity) if start >= 0 else -1, score))
+
+    entities = pd.DataFrame(rows, columns=ENTITY_SCHEMA.names)
+    entities['tweet_id'] = entities['tweet_id'].astype('Int64')
+    return pa.Table.from_pandas(entities, schema=ENTITY_SCHEMA, preserve_index=False)
+
+
+def write_entities(fp, tables):
+    """
+    Write the entity tables of a file to <file>_entities.parquet, one row group per table.
+    """
+    out = f'{os.path.splitext(fp)[0]}{ENTITY_SUFFIX}'
+    tmp = f'{out}.tmp'
+    with pq.ParquetWriter(tmp, ENTITY_SCHEMA) as writer:
+        for table in tables:
+            writer.write_table(table)
+    os.replace(tmp, out)
+    print(f'Entities written to {out}')
+
+
+def label_entities(df):
+    df['text'] = df['text'].astype(str)  # Avoids errors in the detection
+    labels = predict_labels(model, df['text'].tolist(), to_entity_list, batch_size, cache,
+                            min_tokens=min_tokens, neutral=[], return_probability=True)
+    return entity_table(df, labels)
+
+
+def load_file(fp):
+    df = read_table(fp)
+
+    df['text'] = df['text'].astype(str)  # Avoids errors in the detection
+    return df, pd.Series(True, index=df.index)  # Entities are added as new columns, every row is detected
+
+
+def save_file(fp, df, rows, labels):
+    if output_format == 'long':
+        write_entities(fp, [entity_table(df, labels)])
+        return
+
+    df = pd.concat([df, pd.DataFrame(labels, index=df.index[rows])], axis=1)
+    write_table(df, fp)
 
+
+def label_chunk(df):
     df['text'] = df['text'].astype(str)  # Avoids errors in the detection
-    tqdm.pandas()
-    df = pd.concat([df, df['text'].progress_apply(detect_entity).apply(pd.Series)], axis=1)
+    labels = predict_labels(model, df['text'].tolist(), to_entity, batch_size, cache,
+                            min_tokens=min_tokens, neutral=NEUTRAL_LABEL)
+
+    # Every entity type gets a column so that all chunks share the same header
+    return pd.concat([df, pd.DataFrame(labels, index=df.index, columns=sorted(types))], axis=1)
 
-    df.to_csv(fp, index=False)
+
+def process_file(fp):
+    if output_format == 'long':  # The CSV file is left untouched
+        streamed = chunksize and file_format(fp) == 'csv'
+        chunks = pd.read_csv(fp, chunksize=chunksize) if streamed else [read_table(fp)]
+        write_entities(fp, (label_entities(df) for df in chunks))
+        return
+
+    if chunksize:
+        process_file_chunked(fp, chunksize, label_chunk)
+        return
+
+    df, rows = load_file(fp)
+
+    labels = predict_labels(model, df.loc[rows, 'text'].tolist(), to_entity, batch_size, cache,
+                            min_tokens=min_tokens, neutral=NEUTRAL_LABEL)
+    save_file(fp, df, rows, labels)
 
 
 # ------------------------------------------------- MAIN ------------------------------------------------- #
@@ -52,16 +154,22 @@ def process_file(fp):
 def main():
     print(f'Named Entity detection on {input_}...')
 
-    if os.path.isfile(input_):  # Single file
-        fp = input_
-        process_file(fp)
+    files = list_tables(input_)
+    if workers > 1:
+        if output_format == 'long':
+            process_files_parallel(files, load_file, save_file, partial(load_model, backend), to_entity_list, workers,
+                                   batch_size, shard_size, cache, min_tokens, [], return_probability=True)
+        else:
+            process_files_parallel(files, load_file, save_file, partial(load_model, backend), to_entity, workers,
+                                   batch_size, shard_size, cache, min_tokens, NEUTRAL_LABEL)
     else:
-        for root, dirs, files in os.walk(input_):
-            for file in files:
-                if file.endswith(".csv"):
-                    print(file)
-                    fp = os.path.join(root, file)
-                    process_file(fp)
+        for fp in files:
+            print(os.path.basename(fp))
+            process_file(fp)
+
+    if cache is not None:
+        print(cache.stats())
+        cache.close()
 
 
 # -------------------------------------------------- CLI -------------------------------------------------- #
@@ -70,13 +178,24 @@ def main():
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Apply NLP Named Entity detection to a CSV file.')
 
-    parser.add_argument('--input', '--i', type=str, help='Directory or CSV File', required=True)
-    # parser.add_argument('--force', '--fo', action=argparse.BooleanOptionalAction, help='Force detection', default=False)
+    add_detection_arguments(parser, force=False)
+    parser.add_argument('--format', '--f', type=str, choices=['wide', 'long'], default='wide',
+                        help='wide: one column per entity type added to the CSV, long: one row per entity (tweet_id, '
+                             'type, entity, start, end, score) in <file>_entities.parquet (Default: wide)')
 
-    args = parser.parse_args()
-    input_ = args.input
-    # force = args.force
+    args = parse_detection_arguments(parser)
 
-    model = tweetnlp.NER()
+    input_ = args.input
+    batch_size = args.batch_size
+    workers = args.workers
+    shard_size = args.shard_size
+    chunksize = args.chunksize
+    min_tokens = args.min_tokens
+    backend = args.backend
+    output_format = args.format
+    cache_name = MODEL_NAME if output_format == 'wide' else f'{MODEL_NAME}-long'  # Labels differ between formats
+    cache = label_cache(args, cache_name)
+
+    model = LazyModel(partial(load_model, backend))  # Loaded by the first file to detect, workers load their own
 
     main()
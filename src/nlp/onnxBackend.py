@@ -0,0 +1,154 @@
+"""
+ONNX Runtime backend for the tweetnlp models.
+
+The transformer of a tweetnlp model is exported to ONNX, quantized to int8 (dynamic quantization) and run with
+onnxruntime on CPU. Only the forward pass is replaced: tokenization and the decoding of the logits (labels, entities)
+are still done by tweetnlp, so the predictions keep the same format as with the PyTorch backend.
+
+onnx and onnxruntime are optional dependencies: pip install -r requirements-onnx.txt
+"""
+
+# ----------------------------------------------- IMPORTS ----------------------------------------------- #
+
+# External
+import inspect
+import os
+import numpy as np
+import torch
+try:
+    import onnxruntime as ort
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+except ImportError as e:  # The quantization needs onnx too
+    raise ImportError(f'{e.name} is needed by the onnx backend, pip install -r requirements-onnx.txt') from e
+from transformers.modeling_outputs import SequenceClassifierOutput
+
+# Local
+from cache import tweetnlp_version
+
+# ---------------------------------------------- CONSTANTS ---------------------------------------------- #
+
+ONNX_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'twitter_toolbox', 'onnx')
+
+# Tweets compared between the PyTorch and ONNX backends before the ONNX one is used
+PARITY_TEXTS = [
+    'I love this so much, best day ever!',
+    'This is the worst service I have ever had, never again.',
+    'Just landed in London, heading to the hotel now',
+    'Oh great, another Monday. Exactly what I needed...',
+    'The government announced new measures against the virus today',
+    'Can\'t wait for the match tonight, come on you reds!',
+    'I am so tired of all these lies, shut up already',
+    'New album from Taylor Swift is out, listening on repeat',
+    'Apple just released the new iPhone and it looks amazing',
+    'My cat knocked my coffee over again this morning',
+    'Thank you everyone for the birthday wishes, feeling loved',
+    'Stock markets fell sharply after the central bank decision',
+    'Ce film était vraiment génial, je le recommande',
+    'Qué día tan horrible, todo sale mal',
+    'Heute ist das Wetter wunderschön in Berlin',
+    'Non vedo l\'ora di andare in vacanza al mare',
+]
+
+
+# ----------------------------------------------- CLASSES ----------------------------------------------- #
+
+
+class LogitsOnly(torch.nn.Module):
+    """
+    Transformer returning only its logits, the graph exported to ONNX.
+    """
+
+    def __init__(self, transformer):
+        super().__init__()
+        self.transformer = transformer
+
+    def forward(self, input_ids, attention_mask):
+        return self.transformer(input_ids=input_ids, attention_mask=attention_mask).logits
+
+
+class OnnxTransformer:
+    """
+    Stand-in for the transformer of a tweetnlp model, forward passes run in an onnxruntime session.
+    """
+
+    def __init__(self, path, config):
+        self.session = ort.InferenceSession(path, providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.config = config
+        self.device = torch.device('cpu')
+
+    def __call__(self, **inputs):
+        feed = {k: v.cpu().numpy().astype(np.int64) for k, v in inputs.items() if k in self.input_names}
+        logits = self.session.run(['logits'], feed)[0]
+        return SequenceClassifierOutput(logits=torch.from_numpy(logits))  # Gives both .logits and ['logits']
+
+    def to(self, *args, **kwargs):
+        return self
+
+    def eval(self):
+        return self
+
+
+# ---------------------------------------------- FUNCTIONS ---------------------------------------------- #
+
+
+def find_transformer(model):
+    """
+    Object holding the transformer of a tweetnlp model (in its model attribute), the transformer being the first
+    torch module with a config found by following the model attributes.
+    """
+    holder = model
+    while not isinstance(holder.model, torch.nn.Module) or not hasattr(holder.model, 'config'):
+        holder = holder.model
+    return holder
+
+
+def export(transformer, path):
+    """
+    Export a transformer to ONNX and quantize its weights to int8.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fp32_path = f'{path}.{os.getpid()}.fp32'  # Per process, workers may export the same model concurrently
+    int8_path = f'{path}.{os.getpid()}.int8'
+
+    input_ids = torch.tensor([[0, 1, 2]])  # Any valid token ids, batch and sequence sizes are dynamic
+    attention_mask = torch.ones_like(input_ids)
+    axes = {0: 'batch', 1: 'sequence'}
+    # Recent torch versions default to the dynamo exporter (needs onnxscript), the TorchScript one is kept
+    legacy = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+    # The wrapper is put in eval mode too: export restores its mode afterwards, and with it the one of transformer
+    torch.onnx.export(LogitsOnly(transformer.cpu()).eval(), (input_ids, attention_mask), fp32_path,
+                      input_names=['input_ids', 'attention_mask'], output_names=['logits'],
+                      dynamic_axes={'input_ids': axes, 'attention_mask': axes, 'logits': axes}, opset_version=14,
+                      **legacy)
+
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+    os.replace(int8_path, path)
+
+
+def use_onnx(model, model_name, onnx_dir=ONNX_DIR, min_agreement=0.9):
+    """
+    Switch a tweetnlp model to the quantized ONNX backend, exporting it on first use.
+    Predictions of both backends are compared on PARITY_TEXTS first, a RuntimeError is raised if they agree on less
+    than min_agreement of the texts.
+    """
+    holder = find_transformer(model)
+    path = os.path.join(onnx_dir, f'{model_name}-{tweetnlp_version()}.int8.onnx')
+    if not os.path.exists(path):
+        print(f'Exporting {model_name} to {path}...')
+        export(holder.model, path)
+
+    expected = model.predict(PARITY_TEXTS)
+    transformer = holder.model
+    holder.model = OnnxTransformer(path, transformer.config)
+    predictions = model.predict(PARITY_TEXTS)
+
+    agreement = np.mean([p == e for p, e in zip(predictions, expected)])
+    print(f'ONNX backend agrees with PyTorch on {agreement:.0%} of the parity texts')
+    if agreement < min_agreement:
+        holder.model = transformer
+        raise RuntimeError(f'ONNX backend of {model_name} agrees with PyTorch on {agreement:.0%} of the parity texts, '
+                           f'below {min_agreement:.0%}')
+
+    return model
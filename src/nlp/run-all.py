@@ -0,0 +1,143 @@
+"""
+Run several NLP detections on a CSV file in a single pass.
+
+The file is read once, the text column is deduplicated and sorted by length once, every selected model labels it in
+batches, and all the label columns are written back in a single write.
+"""
+
+# ----------------------------------------------- IMPORTS ----------------------------------------------- #
+
+# External
+import argparse
+from functools import partial
+import pandas as pd
+import os
+
+# Local
+from utils import LazyModel, predict_labels, sort_by_length, unique_texts, fan_out, missing_rows, set_labels, \
+    process_file_chunked, list_tables, read_table, write_table, add_detection_arguments, parse_detection_arguments, \
+    label_cache
+import sentiment
+import emotion
+import irony
+import offensive
+import hateSpeech
+import topic
+import namedEntity
+
+# ---------------------------------------------- CONSTANTS ---------------------------------------------- #
+
+# Task name (also the output column) -> (module, function converting a prediction to a label)
+TASKS = {
+    'sentiment': (sentiment, sentiment.to_sentiment),
+    'emotion': (emotion, emotion.to_emotion),
+    'irony': (irony, irony.to_irony),
+    'offensive': (offensive, offensive.to_offensive),
+    'hate': (hateSpeech, hateSpeech.to_hate),
+    'topic': (topic, topic.to_topic),
+    'entity': (namedEntity, namedEntity.to_entity),
+}
+
+DEFAULT_TASKS = ['sentiment', 'emotion', 'irony', 'offensive', 'hate', 'topic']
+
+
+# ---------------------------------------------- FUNCTIONS ---------------------------------------------- #
+
+
+def is_detected(df, task):
+    if task == 'entity':  # One column per entity type
+        return any(t in df.columns for t in namedEntity.types)
+    return task in df.columns and df[task].isnull().sum() == 0
+
+
+def label_frame(df, todo):
+    df['text'] = df['text'].astype(str)  # Avoids errors in the detection
+    texts, codes = unique_texts(df['text'].tolist())
+    order = sort_by_length(texts)
+    print(f'{len(codes) - len(texts)} duplicated texts')
+
+    for task in todo:
+        print(f'{task}...')
+        module, to_label = TASKS[task]
+
+        if task == 'entity':
+            labels = predict_labels(module.model, texts, to_label, batch_size, caches.get(task), order,
+                                    min_tokens, module.NEUTRAL_LABEL)
+            df = df.drop(columns=[t for t in namedEntity.types if t in df.columns])
+            # Every entity type gets a column so that all chunks share the same header
+            entities = pd.DataFrame(fan_out(labels, codes), index=df.index, columns=sorted(namedEntity.types))
+            df = pd.concat([df, entities], axis=1)
+            continue
+
+        rows = missing_rows(df, task, incremental and not force)
+        if rows.all():  # Reuse the deduplicated texts shared by the tasks
+            labels = predict_labels(module.model, texts, to_label, batch_size, caches.get(task), order,
+                                    min_tokens, module.NEUTRAL_LABEL)
+            labels = fan_out(labels, codes)
+        elif rows.any():
+            labels = predict_labels(module.model, df.loc[rows, 'text'].tolist(), to_label, batch_size,
+                                    caches.get(task), min_tokens=min_tokens, neutral=module.NEUTRAL_LABEL)
+        else:
+            continue
+        set_labels(df, rows, task, labels)
+
+    return df
+
+
+def process_file(fp):
+    labels = read_table(fp, columns=set(TASKS) | namedEntity.types)  # Only the label columns to find the tasks to run
+    todo = [task for task in tasks if force or not is_detected(labels, task)]
+
+    if not todo:
+        print('Already detected')
+        return
+
+    if chunksize:
+        process_file_chunked(fp, chunksize, lambda chunk: label_frame(chunk, todo))
+    else:
+        df = label_frame(read_table(fp), todo)
+        write_table(df, fp)
+
+
+# ------------------------------------------------- MAIN ------------------------------------------------- #
+
+
+def main():
+    print(f'{", ".join(tasks)} detection on {input_}...')
+
+    for fp in list_tables(input_):
+        print(os.path.basename(fp))
+        process_file(fp)
+
+    for task, cache in caches.items():
+        print(f'{task} {cache.stats()}')
+        cache.close()
+
+
+# -------------------------------------------------- CLI -------------------------------------------------- #
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Apply several NLP detections to a CSV file in a single pass.')
+
+    add_detection_arguments(parser, workers=False, batch_size=32)
+    parser.add_argument('--tasks', '--t', type=str, nargs='+', choices=list(TASKS), default=DEFAULT_TASKS,
+                        help=f'Detections to run (Default: {" ".join(DEFAULT_TASKS)})')
+
+    args = parse_detection_arguments(parser)
+    input_ = args.input
+    tasks = args.tasks
+    force = args.force
+    incremental = args.incremental
+    batch_size = args.batch_size
+    chunksize = args.chunksize
+    min_tokens = args.min_tokens
+
+    for task in tasks:  # Loaded by the first file to detect
+        module = TASKS[task][0]
+        module.model = LazyModel(partial(module.load_model, args.backend))
+
+    # Task -> label cache, empty without --cache
+    caches = {task: label_cache(args, TASKS[task][0].MODEL_NAME) for task in tasks if args.cache}
+
+    main()
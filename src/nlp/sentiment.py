@@ -12,18 +12,29 @@ Association for Computational Linguistics.
 
 # External
 import argparse
-import pandas as pd
-import os
-from tqdm import tqdm
-import tweetnlp
+
+# Local
+from utils import set_backend, add_detection_arguments, parse_detection_arguments, run_detection
+
+# ---------------------------------------------- CONSTANTS ---------------------------------------------- #
+
+MODEL_NAME = 'sentiment-multilingual'  # Key of the model in the label cache
+NEUTRAL_LABEL = 0  # Neutral, label of the texts too short to go through the model (see --min-tokens)
 
 
 # ---------------------------------------------- FUNCTIONS ---------------------------------------------- #
 
 
-def detect_sentiment(text):
-    topic = model.predict(text)
+def load_model(backend='torch'):
+    global model
+    import tweetnlp  # Imported on first use, it pulls torch and transformers
+
+    model = tweetnlp.Sentiment(multilingual=True)
+    set_backend(model, MODEL_NAME, backend)
+    return model
+
 
+def to_sentiment(topic):
     if topic['label'] == 'positive':
         return 1
     elif topic['label'] == 'negative':
@@ -32,37 +43,8 @@ def detect_sentiment(text):
         return 0
 
 
-def process_file(fp):
-    df = pd.read_csv(fp)
-
-    if 'sentiment' in df.columns and not force:
-        if df['sentiment'].isnull().sum() == 0:
-            print('Already detected')
-            return
-
-    df['text'] = df['text'].astype(str)  # Avoids errors in the detection
-    tqdm.pandas()
-    df['sentiment'] = df['text'].progress_apply(detect_sentiment)
-
-    df.to_csv(fp, index=False)
-
-
-# ------------------------------------------------- MAIN ------------------------------------------------- #
-
-
-def main():
-    print(f'Sentiment detection on {input_}...')
-
-    if os.path.isfile(input_):  # Single file
-        fp = input_
-        process_file(fp)
-    else:
-        for root, dirs, files in os.walk(input_):
-            for file in files:
-                if file.endswith(".csv"):
-                    print(file)
-                    fp = os.path.join(root, file)
-                    process_file(fp)
+def detect_sentiment(text):
+    return to_sentiment(model.predict(text))
 
 
 # -------------------------------------------------- CLI -------------------------------------------------- #
@@ -70,14 +52,8 @@ def main():
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Apply NLP Sentiment detection to a CSV file.')
+    add_detection_arguments(parser)
 
-    parser.add_argument('--input', '--i', type=str, help='Directory or CSV File', required=True)
-    parser.add_argument('--force', '--fo', action=argparse.BooleanOptionalAction, help='Force detection', default=False)
-
-    args = parser.parse_args()
-    input_ = args.input
-    force = args.force
-
-    model = tweetnlp.Sentiment(multilingual=True)
+    args = parse_detection_arguments(parser)
 
-    main()
+    run_detection(args, 'Sentiment', 'sentiment', MODEL_NAME, load_model, to_sentiment, NEUTRAL_LABEL)
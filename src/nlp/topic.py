@@ -12,71 +12,25 @@ Association for Computational Linguistics.
 
 # External
 import argparse
-import pandas as pd
-import os
-from tqdm import tqdm
-import tweetnlp
 
+# Local
+from utils import set_backend, add_detection_arguments, parse_detection_arguments, run_detection
 
-# ---------------------------------------------- FUNCTIONS ---------------------------------------------- #
-
-
-def detect_topic(text):
-    topic = model.predict(text)
-
-    if len(topic['label']) == 0:
-        topic['label'] = ['und']
-
-    return label_to_id[topic['label'][0]]
-
-
-def process_file(fp):
-    df = pd.read_csv(fp)
+# ---------------------------------------------- CONSTANTS ---------------------------------------------- #
 
-    if 'topic' in df.columns and not force:
-        if df['topic'].isnull().sum() == 0:
-            print('Already detected')
-            return
-
-    df['text'] = df['text'].astype(str)  # Avoids errors in the detection
-    tqdm.pandas()
-    df['topic'] = df['text'].progress_apply(detect_topic)
-
-    df.to_csv(fp, index=False)
-
-
-# ------------------------------------------------- MAIN ------------------------------------------------- #
-
-
-def main():
-    print(f'Topic detection on {input_}...')
-
-    if os.path.isfile(input_):  # Single file
-        fp = input_
-        process_file(fp)
-    else:
-        for root, dirs, files in os.walk(input_):
-            for file in files:
-                if file.endswith(".csv"):
-                    print(file)
-                    fp = os.path.join(root, file)
-                    process_file(fp)
-
-
-# -------------------------------------------------- CLI -------------------------------------------------- #
+MODEL_NAME = 'topic'  # Key of the model in the label cache
+NEUTRAL_LABEL = 0  # 'und' topic, label of the texts too short to go through the model (see --min-tokens)
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Apply NLP Topic detection to a CSV file.')
+# ---------------------------------------------- FUNCTIONS ---------------------------------------------- #
 
-    parser.add_argument('--input', '--i', type=str, help='Directory or CSV File', required=True)
-    parser.add_argument('--force', '--fo', action=argparse.BooleanOptionalAction, help='Force detection', default=False)
 
-    args = parser.parse_args()
-    input_ = args.input
-    force = args.force
+def load_model(backend='torch'):
+    global model, label_to_id
+    import tweetnlp  # Imported on first use, it pulls torch and transformers
 
     model = tweetnlp.load_model('topic_classification')
+    set_backend(model, MODEL_NAME, backend)
 
     # /!\ Note: Id 0 is reserved for the 'und' label, All the other labels are shifted by 1 /!\
     label_to_id = {v: int(k) + 1 for k, v in model.id_to_label.items()}
@@ -101,4 +55,27 @@ if __name__ == "__main__":
     # 18: travel_&_adventure
     # 19: youth_&_student_life
 
-    main()
+    return model
+
+
+def to_topic(topic):
+    if len(topic['label']) == 0:
+        topic['label'] = ['und']
+
+    return label_to_id[topic['label'][0]]
+
+
+def detect_topic(text):
+    return to_topic(model.predict(text))
+
+
+# -------------------------------------------------- CLI -------------------------------------------------- #
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Apply NLP Topic detection to a CSV file.')
+    add_detection_arguments(parser)
+
+    args = parse_detection_arguments(parser)
+
+    run_detection(args, 'Topic', 'topic', MODEL_NAME, load_model, to_topic, NEUTRAL_LABEL)
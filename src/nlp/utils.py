@@ -0,0 +1,416 @@
+"""
+Helpers shared by the NLP detection scripts.
+"""
+
+# ----------------------------------------------- IMPORTS ----------------------------------------------- #
+
+# External
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from functools import partial
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+# Local
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # src, shared by the toolbox
+from storage import read_table, write_table, file_format, list_tables, ENTITY_SUFFIX
+from cache import LabelCache
+
+# ----------------------------------------------- GLOBALS ----------------------------------------------- #
+
+worker_model = None  # Model loaded by each worker of the pool (see init_worker)
+
+
+# ----------------------------------------------- CLASSES ----------------------------------------------- #
+
+
+class LazyModel:
+    """
+    Stand-in for a model, the model is only loaded when first used.
+    Runs where every file is already detected (or every label cached) never pay for loading torch and the weights.
+    """
+
+    def __init__(self, load_model):
+        self.load_model = load_model
+        self.model = None
+
+    def __getattr__(self, name):
+        if self.model is None:
+            start = time.time()
+            self.model = self.load_model()
+            print(f'Model loaded in {time.time() - start:.1f}s')
+        return getattr(self.model, name)
+
+
+# ---------------------------------------------- FUNCTIONS ---------------------------------------------- #
+
+
+def set_backend(model, model_name, backend):
+    """
+    Run the forward passes of a tweetnlp model with backend, 'torch' (tweetnlp default) or 'onnx' (see onnxBackend).
+    """
+    if backend == 'onnx':
+        from onnxBackend import use_onnx  # onnxruntime is only needed by this backend
+        use_onnx(model, model_name)
+
+    return model
+
+
+def sort_by_length(texts):
+    """
+    Indices of texts sorted by length, used to group texts of similar length in the same batch.
+    """
+    return sorted(range(len(texts)), key=lambda i: len(texts[i]))
+
+
+def predict_batched(model, texts, batch_size, order=None, **kwargs):
+    """
+    Run model.predict on a list of texts, batch_size texts at a time.
+    Texts are sorted by length so each batch is padded to similar lengths, predictions are returned in the original
+    order of texts. A precomputed order (see sort_by_length) can be given to share it between several models.
+    """
+    if order is None:
+        order = sort_by_length(texts)
+    predictions = [None] * len(texts)
+
+    for start in tqdm(range(0, len(order), batch_size)):
+        batch = order[start:start + batch_size]
+        outputs = model.predict([texts[i] for i in batch], batch_size=batch_size, **kwargs)
+        for i, output in zip(batch, outputs):
+            predictions[i] = output
+
+    return predictions
+
+
+def unique_texts(texts):
+    """
+    Unique texts in order of first appearance, and for every text the position of its unique text.
+    """
+    codes, uniques = pd.factorize(np.asarray(texts, dtype=object))
+    return uniques.tolist(), codes
+
+
+def fan_out(labels, codes):
+    """
+    Broadcast the labels of unique texts back to every text (see unique_texts).
+    """
+    return pd.Series(labels, dtype=object).take(codes).tolist()
+
+
+def run_model(model, texts, to_label, batch_size=None, order=None, **kwargs):
+    """
+    Labels of a list of texts, to_label converts a model prediction to the value stored in the CSV.
+    Texts are predicted one at a time unless a batch_size is given, kwargs are passed to model.predict.
+    """
+    if batch_size:
+        predictions = predict_batched(model, texts, batch_size, order=order, **kwargs)
+    else:
+        predictions = [model.predict(text, **kwargs) for text in tqdm(texts)]
+
+    return [to_label(p) for p in predictions]
+
+
+def short_texts(texts, min_tokens):
+    """
+    Indices of the texts with fewer than min_tokens whitespace separated tokens, missing texts ('nan' once cast to
+    str) count as empty. Cleaned tweets often come down to nothing, there is no point running a model on them.
+    """
+    short = [i for i, text in enumerate(texts) if text == 'nan' or len(text.split()) < min_tokens]
+    if short:
+        print(f'{len(short)} texts under {min_tokens} tokens labelled without the model')
+    return short
+
+
+def cached_labels(model, texts, to_label, batch_size=None, cache=None, order=None, **kwargs):
+    """
+    Labels of a list of unique texts (see run_model). With a cache (see cache.LabelCache), only the texts missing from
+    the cache go through the model.
+    """
+    if cache is None:
+        return run_model(model, texts, to_label, batch_size, order, **kwargs)
+
+    labels = cache.get(texts)
+    missing = [i for i, label in enumerate(labels) if label is None]
+    if missing:
+        missing_texts = [texts[i] for i in missing]
+        missing_labels = run_model(model, missing_texts, to_label, batch_size, **kwargs)
+        cache.put(missing_texts, missing_labels)
+        for i, label in zip(missing, missing_labels):
+            labels[i] = label
+
+    return labels
+
+
+def predict_labels(model, texts, to_label, batch_size=None, cache=None, order=None, min_tokens=0, neutral=None,
+                   **kwargs):
+    """
+    Labels of a list of texts (see run_model).
+    Identical texts go through the model once and their label is broadcast to every row. With a cache (see
+    cache.LabelCache), only the texts missing from the cache go through the model.
+    Texts already made unique by the caller can come with their precomputed order (see sort_by_length).
+    Texts with fewer than min_tokens tokens get the neutral label without going through the model (see short_texts).
+    """
+    if order is None:
+        texts, codes = unique_texts(texts)
+        print(f'{len(codes) - len(texts)} duplicated texts')
+    else:
+        codes = None
+
+    short = short_texts(texts, min_tokens) if min_tokens else []
+    if short:
+        labels = [neutral] * len(texts)
+        short = set(short)
+        kept = [i for i in range(len(texts)) if i not in short]
+        if order is not None:  # Keep the shared order, restricted to the kept texts
+            position = {i: j for j, i in enumerate(kept)}
+            order = [position[i] for i in order if i in position]
+
+        kept_labels = cached_labels(model, [texts[i] for i in kept], to_label, batch_size, cache, order, **kwargs)
+        for i, label in zip(kept, kept_labels):
+            labels[i] = label
+    else:
+        labels = cached_labels(model, texts, to_label, batch_size, cache, order, **kwargs)
+
+    return labels if codes is None else fan_out(labels, codes)
+
+
+def missing_rows(df, column, incremental):
+    """
+    Rows to label: in incremental mode only the rows without a label in column, otherwise all of them.
+    """
+    if incremental and column in df.columns:
+        return df[column].isnull()
+    return pd.Series(True, index=df.index)
+
+
+def set_labels(df, rows, column, labels):
+    """
+    Store the labels of rows in column, keeping the labels of the other rows.
+    """
+    if rows.all():
+        df[column] = labels
+    else:
+        df.loc[rows, column] = labels
+        df[column] = df[column].convert_dtypes()  # Labels read as floats because of the missing ones
+
+
+def is_labelled(fp, column):
+    """
+    Whether every row of a file has a label in column, only that column is read.
+    """
+    df = read_table(fp, columns=[column])
+    return column in df.columns and df[column].isnull().sum() == 0
+
+
+def process_file_chunked(fp, chunksize, label_chunk):
+    """
+    Label a CSV file chunksize rows at a time so memory does not grow with the size of the file.
+    label_chunk(df) returns the labelled chunk, chunks are appended to a temporary file that replaces fp once every
+    chunk is written, fp is left untouched if anything fails.
+    Columnar files (see storage) are read column by column already, they are labelled in one go.
+    """
+    if file_format(fp) != 'csv':
+        write_table(label_chunk(read_table(fp)), fp)
+        return
+
+    tmp = f'{fp}.tmp'
+    try:
+        header = True
+        for chunk in pd.read_csv(fp, chunksize=chunksize):
+            label_chunk(chunk).to_csv(tmp, mode='w' if header else 'a', header=header, index=False)
+            header = False
+
+        if not header:  # Empty files have no chunk
+            os.replace(tmp, fp)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+# ----------------------------------------------- PARALLEL ----------------------------------------------- #
+
+
+def init_worker(load_model):
+    global worker_model
+    worker_model = load_model()
+
+
+def label_shard(texts, to_label, batch_size, kwargs):
+    return run_model(worker_model, texts, to_label, batch_size, **kwargs)
+
+
+def process_files_parallel(files, load_file, save_file, load_model, to_label, workers, batch_size=None,
+                           shard_size=10_000, cache=None, min_tokens=0, neutral=None, **kwargs):
+    """
+    Label files with a pool of workers, each worker loading its own model once.
+    Files are read and written by the main process, their texts are split in row ranges of shard_size rows that are
+    labelled by the workers. Several files are in flight at once so that small files keep all workers busy, files are
+    written in the order of files and labels are merged back in row order. Duplicated texts are removed and the cache,
+    if any, is queried and filled by the main process so only the unique missing texts are sent to the workers. Texts
+    with fewer than min_tokens tokens get the neutral label and are not sent at all (see short_texts).
+
+    load_file(fp) returns the DataFrame and a mask of the rows to label (or None to skip the file),
+    save_file(fp, df, rows, labels) writes it. kwargs are passed to model.predict.
+    """
+    with Pool(workers, initializer=init_worker, initargs=(load_model,)) as pool:
+        pending = deque()
+
+        for fp in files:
+            print(os.path.basename(fp))
+            loaded = load_file(fp)
+            if loaded is None:
+                continue
+
+            df, rows = loaded
+            texts, codes = unique_texts(df.loc[rows, 'text'].tolist())
+            labels = [None] * len(texts)
+            for i in short_texts(texts, min_tokens) if min_tokens else []:
+                labels[i] = neutral
+            if cache is not None:
+                kept = [i for i, label in enumerate(labels) if label is None]
+                for i, label in zip(kept, cache.get([texts[i] for i in kept])):
+                    labels[i] = label
+            missing = [i for i, label in enumerate(labels) if label is None]
+            missing_texts = [texts[i] for i in missing]
+
+            shards = [pool.apply_async(label_shard, (missing_texts[i:i + shard_size], to_label, batch_size, kwargs))
+                      for i in range(0, len(missing_texts), shard_size)]
+            pending.append((fp, df, rows, codes, labels, missing, missing_texts, shards))
+
+            while len(pending) > 2 * workers:  # Bounds the number of files held in memory
+                save_shards(save_file, cache, *pending.popleft())
+
+        while pending:
+            save_shards(save_file, cache, *pending.popleft())
+
+
+def save_shards(save_file, cache, fp, df, rows, codes, labels, missing, missing_texts, shards):
+    missing_labels = [label for shard in shards for label in shard.get()]
+    if cache is not None:
+        cache.put(missing_texts, missing_labels)
+
+    for i, label in zip(missing, missing_labels):
+        labels[i] = label
+    save_file(fp, df, rows, fan_out(labels, codes))
+
+
+# ----------------------------------------------- DETECTION ----------------------------------------------- #
+
+
+def add_detection_arguments(parser, force=True, workers=True, batch_size=None):
+    """
+    Add the options shared by the detection scripts to parser. force adds --force and --incremental, workers adds
+    --workers and --shard-size, batch_size is the default of --batch-size.
+    """
+    parser.add_argument('--input', '--i', type=str, help='Directory or file (CSV, Parquet or Feather)', required=True)
+    if force:
+        parser.add_argument('--force', '--fo', action=argparse.BooleanOptionalAction, help='Force detection',
+                            default=False)
+        parser.add_argument('--incremental', '--in', action=argparse.BooleanOptionalAction,
+                            help='Only detect rows without a label (Default: True)', default=True)
+    parser.add_argument('--batch-size', '--bs', type=int, default=batch_size,
+                        help=f'Number of tweets per forward pass (Default: {batch_size or "one tweet at a time"})')
+    if workers:
+        parser.add_argument('--workers', '--w', type=int, help='Number of worker processes (Default: 1)', default=1)
+        parser.add_argument('--shard-size', '--ss', type=int,
+                            help='Rows labelled per task by a worker (Default: 10000)', default=10_000)
+    parser.add_argument('--cache', '--c', type=str, help='SQLite file caching labels across runs (Default: no cache)',
+                        default=None)
+    parser.add_argument('--cache-size', '--cs', type=int, help='Maximum number of cached labels (Default: 5000000)',
+                        default=5_000_000)
+    parser.add_argument('--backend', '--be', type=str, choices=['torch', 'onnx'], default='torch',
+                        help='Inference backend, onnx runs a quantized int8 export on CPU (Default: torch)')
+    parser.add_argument('--chunksize', '--cz', type=int,
+                        help='Rows per chunk when streaming files to bound memory (Default: whole file)', default=None)
+    parser.add_argument('--min-tokens', '--mt', type=int, default=0,
+                        help='Texts with fewer tokens get a neutral label without running the model (Default: 0, off)')
+
+
+def parse_detection_arguments(parser):
+    args = parser.parse_args()
+    if args.chunksize and getattr(args, 'workers', 1) > 1:
+        parser.error('--chunksize streams files in a single process, it cannot be used with --workers')
+    return args
+
+
+def label_cache(args, model_name):
+    """
+    Label cache of a model from the options of add_detection_arguments, None without --cache.
+    """
+    return LabelCache(args.cache, model_name, args.backend, max_size=args.cache_size) if args.cache else None
+
+
+def run_detection(args, name, column, model_name, load_model, to_label, neutral):
+    """
+    Label every file of args.input in column, args coming from add_detection_arguments.
+    load_model(backend) loads the model, to_label converts one of its predictions to a label, neutral is the label of
+    the texts too short to go through the model (see --min-tokens).
+    """
+    cache = label_cache(args, model_name)
+    model = LazyModel(partial(load_model, args.backend))  # Loaded by the first file to detect, workers load their own
+
+    def predict(texts):
+        return predict_labels(model, texts, to_label, args.batch_size, cache, min_tokens=args.min_tokens,
+                              neutral=neutral)
+
+    def detected(fp):
+        """
+        Whether every row of fp already has a label, only the label column is read.
+        """
+        if not args.force and is_labelled(fp, column):
+            print('Already detected')
+            return True
+        return False
+
+    def load_file(fp):
+        if detected(fp):
+            return None
+
+        df = read_table(fp)
+        df['text'] = df['text'].astype(str)  # Avoids errors in the detection
+        return df, missing_rows(df, column, args.incremental and not args.force)
+
+    def save_file(fp, df, rows, labels):
+        set_labels(df, rows, column, labels)
+        write_table(df, fp)
+
+    def label_chunk(df):
+        df['text'] = df['text'].astype(str)  # Avoids errors in the detection
+        rows = missing_rows(df, column, args.incremental and not args.force)
+        if rows.any():
+            set_labels(df, rows, column, predict(df.loc[rows, 'text'].tolist()))
+
+        return df
+
+    def process_file(fp):
+        if args.chunksize:
+            if not detected(fp):
+                process_file_chunked(fp, args.chunksize, label_chunk)
+            return
+
+        loaded = load_file(fp)
+        if loaded is None:
+            return
+
+        df, rows = loaded
+        save_file(fp, df, rows, predict(df.loc[rows, 'text'].tolist()))
+
+    print(f'{name} detection on {args.input}...')
+
+    files = list_tables(args.input)
+    if args.workers > 1:
+        process_files_parallel(files, load_file, save_file, partial(load_model, args.backend), to_label, args.workers,
+                               args.batch_size, args.shard_size, cache, args.min_tokens, neutral)
+    else:
+        for fp in files:
+            print(os.path.basename(fp))
+            process_file(fp)
+
+    if cache is not None:
+        print(cache.stats())
+        cache.close()
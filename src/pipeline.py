@@ -0,0 +1,274 @@
+"""
+Run several preprocessing and NLP stages on tweet tables in a single pass, from a JSON config:
+
+    {
+        "input": "data/sample-stream",
+        "output": "data/processed",
+        "format": "parquet",
+        "chunksize": 100000,
+        "stages": [
+            {"stage": "filter-language", "languages": ["en", "fr"]},
+            {"stage": "clean-tweets", "emojis": true},
+            {"stage": "checkpoint", "output": "data/cleaned"},
+            {"stage": "languages", "fast": true},
+            {"stage": "nlp", "tasks": ["sentiment", "emotion"], "batch_size": 32},
+            {"stage": "generate-sub-df", "group_by": "timestamp", "unit": "D"}
+        ]
+    }
+
+    python src/pipeline.py --config pipeline.json
+
+Every file of the input is read once, chunksize rows at a time for CSV files, and its chunks flow from stage to stage
+in memory. Tables are only written by checkpoints and at the end (output, in format, by default the one of the input
+file), instead of once per script. Options of a stage are the options of its script (see STAGES), the CLI flags with
+underscores. Data acquisition (scraping, hydration) stays with its scripts, the pipeline starts from their files.
+"""
+
+# ----------------------------------------------- IMPORTS ----------------------------------------------- #
+
+# External
+import argparse
+import importlib
+import json
+import os
+import sys
+import pandas as pd
+from functools import partial
+
+# Local
+from storage import read_table, write_table, file_format, with_format, list_tables, has_lone_cr
+
+# ---------------------------------------------- CONSTANTS ---------------------------------------------- #
+
+PREPROCESSING = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'preprocessing')
+NLP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nlp')
+
+# Stage -> options and their defaults, as in the CLI of the script
+STAGES = {
+    'filter-language': {'languages': ['en', 'es', 'fr', 'it', 'de']},
+    'clean-tweets': {'punctuation': False, 'accents': False, 'emojis': False, 'mentions': False, 'urls': False,
+                     'spaces': False, 'rt': False, 'lowercase': False},
+    'languages': {'fast': False, 'force': False, 'threads': os.cpu_count(), 'min_tokens': 0},
+    'nlp': {'tasks': None, 'force': False, 'incremental': True, 'batch_size': 32, 'backend': 'torch', 'cache': None,
+            'cache_size': 5_000_000, 'min_tokens': 0},
+    'checkpoint': {'output': None, 'format': None},
+    'generate-sub-df': {'group_by': None, 'unit': None, 'min_size': 100, 'buffer_size': 1_000_000, 'output': None},
+}
+
+
+# ---------------------------------------------- FUNCTIONS ---------------------------------------------- #
+
+
+def import_script(directory, name):
+    """
+    Import a script of the toolbox. preprocessing and nlp both have a utils module: the one of directory is imported
+    for the script, and removed again so that the scripts of the other directory import theirs.
+    """
+    sys.path.insert(0, directory)
+    sys.modules.pop('utils', None)
+    try:
+        return importlib.import_module(name)
+    finally:
+        sys.path.remove(directory)
+        sys.modules.pop('utils', None)
+
+
+def stage_options(stage):
+    """
+    Options of a stage of the config, with the defaults of the script.
+    """
+    name = stage.get('stage')
+    if name not in STAGES:
+        raise ValueError(f'Unknown stage {name}, choose between {", ".join(STAGES)}')
+
+    unknown = set(stage) - set(STAGES[name]) - {'stage'}
+    if unknown:
+        raise ValueError(f'Unknown options for {name}: {", ".join(sorted(unknown))}')
+    return {**STAGES[name], **{k: v for k, v in stage.items() if k != 'stage'}}
+
+
+def map_chunks(function, chunks, name):
+    return (function(chunk) for chunk in chunks)
+
+
+def write_chunks(chunks, fp):
+    """
+    Write the chunks of a table to fp while yielding them on, through a temporary file. CSV chunks are appended one
+    at a time, columnar formats are written at once when the table is complete.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(fp)), exist_ok=True)
+    if file_format(fp) != 'csv':
+        frames = []
+        for chunk in chunks:
+            frames.append(chunk)
+            yield chunk
+        write_table(pd.concat(frames, ignore_index=True), fp)
+        return
+
+    tmp = f'{fp}.tmp'
+    columns = None  # Header of the file, set by the first chunk
+    try:
+        for chunk in chunks:
+            if columns is None:
+                columns = chunk.columns
+                chunk.to_csv(tmp, index=False)
+            else:
+                chunk.reindex(columns=columns).to_csv(tmp, mode='a', header=False, index=False)
+            yield chunk
+        if columns is not None:  # Empty files have no chunk
+            os.replace(tmp, fp)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def output_path(directory, name, fmt):
+    return with_format(os.path.join(directory, name), fmt or file_format(name))
+
+
+# ------------------------------------------------ STAGES ------------------------------------------------ #
+
+
+def filter_language_stage(options):
+    module = import_script(PREPROCESSING, 'filter-language')
+    module.languages = options['languages']
+    return partial(map_chunks, module.filter_frame)
+
+
+def clean_tweets_stage(options):
+    module = import_script(PREPROCESSING, 'clean-tweets')
+    module.set_options(argparse.Namespace(input=None, output=None, chunksize=None, format=None, **options))
+    return lambda chunks, name: module.clean_chunks(chunks)
+
+
+def languages_stage(options):
+    module = import_script(NLP, 'languages')
+    builder = module.LanguageDetectorBuilder.from_languages(*module.LANGUAGES)
+    module.detector = (builder.with_low_accuracy_mode() if options['fast'] else builder).build()
+    module.threads = options['threads']
+    module.min_tokens = options['min_tokens']
+
+    def detect(chunk):  # As the script, chunks with a lang for every tweet are not detected again
+        if not options['force'] and 'lang' in chunk.columns and chunk['lang'].notnull().all():
+            return chunk
+        return module.detect_frame(chunk)
+
+    return partial(map_chunks, detect)
+
+
+def nlp_stage(options):
+    module = import_script(NLP, 'run-all')
+    if options['backend'] == 'onnx':  # Imported by set_backend when the models load, nlp is off the path by then
+        import_script(NLP, 'onnxBackend')
+    tasks = options['tasks'] or module.DEFAULT_TASKS
+    for task in tasks:  # Loaded by the first chunk to detect
+        task_module = module.TASKS[task][0]
+        task_module.model = module.LazyModel(partial(task_module.load_model, options['backend']))
+
+    module.force = options['force']
+    module.incremental = options['incremental']
+    module.batch_size = options['batch_size']
+    module.min_tokens = options['min_tokens']
+    cache_options = argparse.Namespace(cache=options['cache'], backend=options['backend'],
+                                       cache_size=options['cache_size'])
+    module.caches = {task: module.label_cache(cache_options, module.TASKS[task][0].MODEL_NAME)
+                     for task in tasks if options['cache']}
+    caches.extend(module.caches.items())
+    return partial(map_chunks, lambda chunk: module.label_frame(chunk, tasks))
+
+
+def checkpoint_stage(options):
+    if not options['output']:
+        raise ValueError('Add an output directory to the checkpoint stage')
+    return lambda chunks, name: write_chunks(chunks, output_path(options['output'], name, options['format']))
+
+
+def generate_sub_df_stage(options):
+    module = import_script(PREPROCESSING, 'generate-sub-df')
+    module.group_by = options['group_by']
+    module.unit = options['unit']
+    module.min_size = options['min_size']
+    module.buffer_size = options['buffer_size']
+    if not module.group_by:
+        raise ValueError('Add a group_by option to the generate-sub-df stage')
+    if module.group_by == 'timestamp' and module.unit not in ['D', 'M', 'Y']:
+        raise ValueError('Add a unit option. Unit must be one of "D" (day), "M" (month), "Y" (year)')
+
+    def route(chunks, name):
+        # Without an output, next to the file as the script (name is relative to the input directory)
+        directory = options['output'] or output or (input_ if os.path.isdir(input_) else os.path.dirname(input_))
+        stem = os.path.splitext(os.path.join(directory, name))[0]
+        return module.route_chunks(chunks, f'{stem}_by_{module.group_by}')
+
+    return route
+
+
+BUILDERS = {
+    'filter-language': filter_language_stage,
+    'clean-tweets': clean_tweets_stage,
+    'languages': languages_stage,
+    'nlp': nlp_stage,
+    'checkpoint': checkpoint_stage,
+    'generate-sub-df': generate_sub_df_stage,
+}
+
+
+# ------------------------------------------------- MAIN ------------------------------------------------- #
+
+
+def read_chunks(fp):
+    kwargs = {'lineterminator': '\n'} if file_format(fp) == 'csv' and has_lone_cr(fp) else {}  # As clean-tweets
+    if file_format(fp) == 'csv' and chunksize:
+        return pd.read_csv(fp, chunksize=chunksize, **kwargs)
+    return iter([read_table(fp, **kwargs)])
+
+
+def process_file(fp, stages, name):
+    """
+    Run the stages on the chunks of a file, returns the number of tweets coming out of the last stage.
+    """
+    chunks = read_chunks(fp)
+    for stage in stages:
+        chunks = stage(chunks, name)
+    return sum(len(chunk) for chunk in chunks)  # Chunks are pulled through the stages one at a time
+
+
+def main():
+    if not output and not any(stage['stage'] in ['checkpoint', 'generate-sub-df'] for stage in config['stages']):
+        raise ValueError('Add an output, a checkpoint or a generate-sub-df stage, nothing would be written')
+
+    stages = [BUILDERS[stage['stage']](stage_options(stage)) for stage in config['stages']]
+    if output:
+        stages.append(checkpoint_stage({'output': output, 'format': fmt}))
+
+    files = list_tables(input_)
+    print(f'{" -> ".join(stage["stage"] for stage in config["stages"])} on {len(files)} files...')
+    for fp in files:
+        name = os.path.basename(fp) if os.path.isfile(input_) else os.path.relpath(fp, input_)
+        print(name)
+        print(f'{process_file(fp, stages, name)} tweets')
+
+    for task, cache in caches:
+        print(f'{task} {cache.stats()}')
+        cache.close()
+
+
+# -------------------------------------------------- CLI -------------------------------------------------- #
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run preprocessing and NLP stages on tweet tables in a single pass.')
+
+    parser.add_argument('--config', '--c', type=str, help='JSON config of the pipeline', required=True)
+
+    args = parser.parse_args()
+    with open(args.config) as f:
+        config = json.load(f)
+
+    input_ = config['input']
+    output = config.get('output')
+    fmt = config.get('format')
+    chunksize = config.get('chunksize')
+    caches = []  # (task, label cache) of the nlp stages, closed at the end
+
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark the whitespace and emoji cleaning of clean-tweets.py against the previous implementations.
+
+The previous implementations are kept here as references. Both are run on the texts of a CSV file of tweets and the
+time per function and the number of tweets whose output differs are reported.
+"""
+
+# -------------------------------------------------- IMPORTS -------------------------------------------------- #
+
+# External
+import argparse
+import importlib
+import re
+import time
+import emoji
+import pandas as pd
+
+# Local
+clean_tweets = importlib.import_module('clean-tweets')
+
+# ------------------------------------------------- CONSTANTS ------------------------------------------------- #
+
+LEGACY_EMOJI_PATTERN = re.compile("["
+                                  u"\U0001F600-\U0001F64F"  # emoticons
+                                  u"\U0001F300-\U0001F5FF"  # symbols & pictographs
+                                  u"\U0001F680-\U0001F6FF"  # transport & map symbols
+                                  u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
+                                  u"\U00002702-\U000027B0"
+                                  u"\U000024C2-\U0001F251"
+                                  "]+", flags=re.UNICODE)
+
+
+# ------------------------------------------------- FUNCTIONS ------------------------------------------------- #
+
+def legacy_remove_extra_spaces(text):
+    text = text.replace('  ', ' ')  # 2 spaces
+    text = text.replace('   ', ' ')  # 3 spaces
+    text = text.replace('    ', ' ')  # 4 spaces
+    text = text.replace('     ', ' ')  # 5 spaces
+    text = text.replace('      ', ' ')  # 6 spaces
+    return text
+
+
+def legacy_remove_emoji(text):
+    text = LEGACY_EMOJI_PATTERN.sub(r'', text)
+    return emoji.replace_emoji(text, replace="")
+
+
+def run(function, texts):
+    """
+    Outputs of function on texts, and the best time in seconds over repeat runs.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        outputs = [function(text) for text in texts]
+        best = min(best, time.perf_counter() - start)
+    return outputs, best
+
+
+def compare(name, legacy, current, texts):
+    legacy_outputs, legacy_time = run(legacy, texts)
+    outputs, current_time = run(current, texts)
+    differ = sum(a != b for a, b in zip(legacy_outputs, outputs))
+
+    print(f'{name}: {legacy_time:.3f}s -> {current_time:.3f}s ({legacy_time / current_time:.1f}x), '
+          f'{differ} of {len(texts)} tweets differ')
+    for text, a, b in [(t, a, b) for t, a, b in zip(texts, legacy_outputs, outputs) if a != b][:examples]:
+        print(f'    {text!r}\n        legacy:  {a!r}\n        current: {b!r}')
+
+
+# -------------------------------------------------- MAIN -------------------------------------------------- #
+
+
+def main():
+    texts = pd.read_csv(input_, usecols=['text'], nrows=rows)['text'].dropna().astype(str).tolist()
+    print(f'Benchmark on {len(texts)} tweets of {input_}, best of {repeat} runs...')
+
+    compare('remove_extra_spaces', legacy_remove_extra_spaces, clean_tweets.remove_extra_spaces, texts)
+    compare('remove_emoji', legacy_remove_emoji, clean_tweets.remove_emoji, texts)
+
+
+# -------------------------------------------------- CLI -------------------------------------------------- #
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the cleaning functions against their previous versions.')
+    parser.add_argument('--input', '--i', type=str, help='CSV File of tweets (text column)', required=True)
+    parser.add_argument('--rows', '--r', type=int, help='Number of tweets to read (Default: all)', default=None)
+    parser.add_argument('--repeat', '--re', type=int, help='Runs of every function (Default: 3)', default=3)
+    parser.add_argument('--examples', '--ex', type=int, help='Differing tweets to print (Default: 5)', default=5)
+
+    args = parser.parse_args()
+
+    input_ = args.input
+    rows = args.rows
+    repeat = args.repeat
+    examples = args.examples
+
+    main()
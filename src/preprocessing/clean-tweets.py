@@ -14,44 +14,60 @@ import argparse
 import string
 from unidecode import unidecode
 from tqdm import tqdm
+from multiprocessing import Pool
 from pandas.errors import ParserError
 
+# Local
+from utils import char_class, alternation, TweetIdSet, read_table, write_table, file_format, with_format, list_tables, \
+    has_lone_cr
+
+
+# ------------------------------------------------- CONSTANTS ------------------------------------------------- #
+
+# Patterns are compiled once, not once per tweet
+EMOTICON_PATTERN = re.compile(u'(' + u'|'.join(re.escape(k) for k in EMOTICONS_EMO) + u')')
+EMOJI_RANGES = [
+    (0x1F600, 0x1F64F),  # emoticons
+    (0x1F300, 0x1F5FF),  # symbols & pictographs
+    (0x1F680, 0x1F6FF),  # transport & map symbols
+    (0x1F1E0, 0x1F1FF),  # flags (iOS)
+    (0x2702, 0x27B0),
+    (0x24C2, 0x1F251),
+]
+VARIATION_SELECTORS = range(0xFE00, 0xFE0F + 1)  # Inside the last range, only removed as part of an emoji
+EMOJI_CHARACTERS = [c for start, end in EMOJI_RANGES for c in range(start, end + 1) if c not in VARIATION_SELECTORS]
+# Whole emojis known to the emoji package (longest sequence first: keycaps, ZWJ sequences, tag flags) and the
+# characters of the ranges above, removed in a single scan of the text. Joiners and selectors outside of an emoji are
+# kept, they are part of other scripts too. The lookahead on the first characters fails every other position at once
+# instead of trying each branch of the alternation.
+EMOJI_PATTERN = re.compile('(?:(?=' + char_class([ord(e[0]) for e in emoji.EMOJI_DATA] + EMOJI_CHARACTERS) + ')(?:' +
+                           alternation(emoji.EMOJI_DATA) + '|' + char_class(EMOJI_CHARACTERS) + '))+')
+URL_PATTERN = re.compile(r"http\S+")
+TWITTER_URL_PATTERN = re.compile(r"pic.twitter\S+")
+MENTION_PATTERN = re.compile(r'@\w+')
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation + "«»")
+
 
 # ------------------------------------------------- FUNCTIONS ------------------------------------------------- #
 
 def remove_emoticons(text):
-    emoticon_pattern = re.compile(u'(' + u'|'.join(k for k in EMOTICONS_EMO) + u')')
-    return emoticon_pattern.sub(r'', text)
+    return EMOTICON_PATTERN.sub(r'', text)
 
 
 def remove_emoji(text):
-    emoji_pattern = re.compile("["
-                               u"\U0001F600-\U0001F64F"  # emoticons
-                               u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-                               u"\U0001F680-\U0001F6FF"  # transport & map symbols
-                               u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
-                               u"\U00002702-\U000027B0"
-                               u"\U000024C2-\U0001F251"
-                               "]+", flags=re.UNICODE)
-    return emoji_pattern.sub(r'', text)
+    return EMOJI_PATTERN.sub(r'', text)
 
 
 def remove_urls(text):
-    result = re.sub(r"http\S+", "", text)
-    return (result)
+    return URL_PATTERN.sub("", text)
 
 
 def remove_twitter_urls(text):
-    clean = re.sub(r"pic.twitter\S+", "", text)
-    return (clean)
-
-
-def give_emoji_free_text(text):
-    return emoji.replace_emoji(text, replace="")
+    return TWITTER_URL_PATTERN.sub("", text)
 
 
 def remove_mentions(text):
-    return re.sub(r'@\w+', '', text)
+    return MENTION_PATTERN.sub('', text)
 
 
 def to_lowercase(text):
@@ -59,17 +75,11 @@ def to_lowercase(text):
 
 
 def remove_punctuation(text):
-    special_chars = "«»"
-    return text.translate(str.maketrans('', '', string.punctuation + special_chars))
+    return text.translate(PUNCTUATION_TABLE)
 
 
 def remove_extra_spaces(text):
-    text = text.replace('  ', ' ')  # 2 spaces
-    text = text.replace('   ', ' ')  # 3 spaces
-    text = text.replace('    ', ' ')  # 4 spaces
-    text = text.replace('     ', ' ')  # 5 spaces
-    text = text.replace('      ', ' ')  # 6 spaces
-    return text
+    return ' '.join(text.split())  # Runs of any length and any whitespace, leading and trailing ones dropped
 
 
 def remove_accents(text):
@@ -82,13 +92,59 @@ def remove_rt(text):
     return text
 
 
-def process_file(fp):
-    try:
-        df = pd.read_csv(fp, encoding='utf-8')
-    except ParserError:
-        print(f'ParserError: {fp}')
-        df = pd.read_csv(fp, lineterminator='\n', encoding='utf-8')
+def cleaning_steps():
+    """
+    Cleaning functions enabled by the flags, in the order they are applied.
+    """
+    steps = []
+    if urls:
+        steps += [remove_urls, remove_twitter_urls]
+    if emojis:
+        steps.append(remove_emoji)
+    if mentions:
+        steps.append(remove_mentions)
+    if punctuation:
+        steps.append(remove_punctuation)
+    if accents:
+        steps.append(remove_accents)
+    if rt:
+        steps.append(remove_rt)
+    if spaces:
+        steps.append(remove_extra_spaces)
+    if lowercase:
+        steps.append(to_lowercase)
+    return steps
+
+
+def set_options(args):
+    """
+    Set the cleaning options from the parsed arguments, in the main process and in every worker.
+    """
+    global options, input_, output_, punctuation, accents, emojis, mentions, urls, spaces, rt, lowercase, steps, \
+        chunksize, output_format
+    options = args
+    input_ = args.input
+    output_ = args.output
+    punctuation = not args.punctuation
+    accents = not args.accents
+    emojis = not args.emojis
+    mentions = not args.mentions
+    urls = not args.urls
+    spaces = not args.spaces
+    rt = not args.rt
+    lowercase = not args.lowercase
+    steps = cleaning_steps()
+    chunksize = args.chunksize
+    output_format = args.format
+
+
+def clean_text(text):
+    for step in steps:
+        text = step(text)
+    return text
+
 
+def clean_frame(df):
     df.dropna(inplace=True)
     df.drop_duplicates(subset=['tweet_id'], inplace=True)
 
@@ -96,31 +152,82 @@ def process_file(fp):
     df['user_id'].replace('error-co', 0, inplace=True)  # Error in the data (user_id = 'error-co')
     df['user_id'] = df['user_id'].astype(int)
 
-    df['text'] = df['text'].str.replace('\n', '')
-    df['text'] = df['text'].str.replace('\r', '')
+    df['text'] = df['text'].str.replace(r'[\r\n]', '', regex=True)
 
-    if urls:
-        df['text'] = df['text'].apply(lambda x: remove_urls(x))
-        df['text'] = df['text'].apply(lambda x: remove_twitter_urls(x))
-    if emojis:
-        df['text'] = df['text'].apply(lambda x: remove_emoji(x))
-        df['text'] = df['text'].apply(lambda x: give_emoji_free_text(x))
-    if mentions:
-        df['text'] = df['text'].apply(lambda x: remove_mentions(x))
-    if punctuation:
-        df['text'] = df['text'].apply(lambda x: remove_punctuation(x))
-    if accents:
-        df['text'] = df['text'].apply(lambda x: remove_accents(x))
-    if rt:
-        df['text'] = df['text'].apply(lambda x: remove_rt(x))
-    if spaces:
-        df['text'] = df['text'].apply(lambda x: remove_extra_spaces(x))
-    if lowercase:
-        df['text'] = df['text'].apply(lambda x: to_lowercase(x))
+    if steps:  # Single pass over the tweets, every enabled step applied to a tweet in turn
+        df['text'] = [clean_text(text) for text in df['text']]
+
+    return df
+
+
+def clean_chunks(chunks):
+    """
+    Clean the chunks of a file, tweets already written by a previous chunk are dropped. Memory is bounded by the chunk
+    size and the tweet ids already seen.
+    """
+    seen = TweetIdSet()  # Tweet ids written by the previous chunks
+    for chunk in chunks:
+        chunk = clean_frame(chunk)
+        yield chunk[seen.add_new(chunk['tweet_id'])].copy()  # Not a view, later stages may add columns
+
+
+def process_file_chunked(fp, out):
+    """
+    Clean a file chunksize rows at a time (see clean_chunks).
+    The parser settings are chosen once up front since a ParserError cannot be recovered in the middle of the file.
+    Chunks are appended to a temporary file that replaces out once the whole file is cleaned.
+    """
+    kwargs = {'lineterminator': '\n'} if has_lone_cr(fp) else {}
+    tmp = f'{out}.tmp'
+    tweets = 0
+    try:
+        header = True
+        for chunk in clean_chunks(pd.read_csv(fp, encoding='utf-8', chunksize=chunksize, **kwargs)):
+            chunk.to_csv(tmp, mode='w' if header else 'a', header=header, index=False)
+            header = False
+            tweets += len(chunk)
+
+        if not header:  # Empty files have no chunk
+            os.replace(tmp, out)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    return tweets
+
+
+def process_file(fp):
+    out = with_format(os.path.join(output_, os.path.basename(fp)), output_format)
+    if chunksize and file_format(fp) == 'csv':
+        tweets = process_file_chunked(fp, out)
+        print(f'Cleaned {os.path.basename(fp)}')
+        return tweets
+
+    if file_format(fp) != 'csv':  # Columnar files keep their types, no parsing involved
+        df = read_table(fp)
+    else:
+        try:
+            df = pd.read_csv(fp, encoding='utf-8')
+        except ParserError:
+            print(f'ParserError: {fp}')
+            df = pd.read_csv(fp, lineterminator='\n', encoding='utf-8')
 
-    df.to_csv(os.path.join(output_, os.path.basename(fp)), index=False)
+    df = clean_frame(df)
+    write_table(df, out)
 
     print(f'Cleaned {os.path.basename(fp)}')
+    return len(df)
+
+
+def clean_file(fp):
+    """
+    Clean a file, errors are caught so that one bad file does not stop the others.
+    Returns the file, the number of tweets written and the error if any.
+    """
+    try:
+        return fp, process_file(fp), None
+    except Exception as e:
+        return fp, 0, f'{type(e).__name__}: {e}'
 
 
 # -------------------------------------------------- MAIN -------------------------------------------------- #
@@ -131,22 +238,26 @@ def main():
     if not os.path.exists(output_):
         os.makedirs(output_)
 
-    if os.path.isfile(input_):
-        process_file(input_)
+    files = list_tables(input_)
+
+    if workers > 1:  # Files are independent, each worker cleans whole files
+        with Pool(workers, initializer=set_options, initargs=(options,)) as pool:
+            results = list(tqdm(pool.imap_unordered(clean_file, files), total=len(files)))
     else:
+        results = [clean_file(fp) for fp in tqdm(files)]
 
-        for root, dirs, files in os.walk(input_):
-            for file in tqdm(files):
-                if file.endswith(".csv"):
-                    fp = os.path.join(root, file)
-                    process_file(fp)
+    failed = [(fp, error) for fp, _, error in results if error]
+    print(f'Cleaned {len(results) - len(failed)} files ({sum(n for _, n, _ in results)} tweets), '
+          f'{len(failed)} failed')
+    for fp, error in sorted(failed):
+        print(f'Failed {fp}: {error}')
 
 
 # -------------------------------------------------- CLI -------------------------------------------------- #
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Perform data cleaning on the raw linguistic data.')
-    parser.add_argument('--input', '--i', type=str, help='Directory containing the raw data, or CSV File',
+    parser.add_argument('--input', '--i', type=str, help='Directory containing the raw data, or file',
                         required=True)
     parser.add_argument('--output', '--o', type=str, help='Directory to save the scraping-cleaned data.', required=True)
 
@@ -158,18 +269,18 @@ if __name__ == '__main__':
     parser.add_argument('--spaces', '--s', action=argparse.BooleanOptionalAction, help='Keep extra spaces', default=False)
     parser.add_argument('--rt', '--r', action=argparse.BooleanOptionalAction, help='Keep RT', default=False)
     parser.add_argument('--lowercase', '--l', action=argparse.BooleanOptionalAction, help='Keep lowercase', default=False)
+    parser.add_argument('--workers', '--w', type=int, help='Number of worker processes (Default: 1)', default=1)
+    parser.add_argument('--chunksize', '--cz', type=int,
+                        help='Rows per chunk when streaming CSV files to bound memory (Default: whole file)',
+                        default=None)
+    parser.add_argument('--format', '--f', type=str, choices=['csv', 'parquet', 'feather'], default='csv',
+                        help='Format of the cleaned files (Default: csv)')
 
     args = parser.parse_args()
+    if args.chunksize and args.format != 'csv':
+        parser.error('--chunksize appends CSV chunks, it cannot be used with --format parquet or feather')
 
-    input_ = args.input
-    output_ = args.output
-    punctuation = not args.punctuation
-    accents = not args.accents
-    emojis = not args.emojis
-    mentions = not args.mentions
-    urls = not args.urls
-    spaces = not args.spaces
-    rt = not args.rt
-    lowercase = not args.lowercase
+    set_options(args)
+    workers = args.workers
 
     main()
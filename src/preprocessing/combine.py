@@ -1,5 +1,10 @@
 """
 Combine all the data into one file from a directory
+
+Files are streamed chunk by chunk and appended to the output, so memory does not grow with the size of the data.
+Duplicated tweets (same tweet_id) are dropped on the fly, keeping the first one, using the set of the tweet ids
+already written (see utils.TweetIdSet, 8 bytes per tweet). With --index the set is kept across runs: tweets combined
+by a previous run are skipped and the new ones are appended to the existing output.
 """
 
 # ---------------------------------------------------- IMPORTS ------------------------------------------------------- #
@@ -7,27 +12,69 @@ Combine all the data into one file from a directory
 # External
 import argparse
 import os
+import shutil
 import pandas as pd
 from tqdm import tqdm
 
+# Local
+from utils import TweetIdSet, parse_tweet_ids
+
 
 # ---------------------------------------------------- SCRIPT -------------------------------------------------------- #
 
 def main():
+    output_fp = os.path.join(input_, output)
     full_paths = []
     for root, dirs, files in os.walk(input_):
         for file in files:
-            if file.endswith(".csv"):
-                full_paths.append(os.path.join(root, file))
+            fp = os.path.join(root, file)
+            if file.endswith(".csv") and os.path.abspath(fp) != os.path.abspath(output_fp):  # Not a previous output
+                full_paths.append(fp)
+
+    seen = TweetIdSet(index)  # Tweet ids written, by this run or the previous ones with --index
+    previous = index is not None and os.path.exists(output_fp)  # Output of a previous run, appended to
+    if len(seen) and not previous:
+        raise ValueError(f'{index} holds the tweets of {output_fp} which does not exist anymore, they would be skipped. '
+                         f'Remove the index to combine every tweet again')
+
+    # Header of the output: every column of the previous output and of every file, in order of appearance
+    columns = list(pd.read_csv(output_fp, nrows=0).columns) if previous else []
+    previous_columns = list(columns)
+    for fp in full_paths:
+        columns += [c for c in pd.read_csv(fp, nrows=0).columns if c not in columns]
+
+    tmp = f'{output_fp}.tmp'
+    rows = duplicates = 0
+    try:
+        if previous and columns == previous_columns and os.path.exists(index):
+            shutil.copyfile(output_fp, tmp)
+        else:
+            pd.DataFrame(columns=columns).to_csv(tmp, index=False)
+            if previous:  # New columns, or an index created from an existing output: its tweets are kept as they are
+                for chunk in pd.read_csv(output_fp, chunksize=chunksize, dtype=str):  # Written as read
+                    ids, valid = parse_tweet_ids(chunk['tweet_id'])
+                    seen.add(ids[valid])
+                    chunk.reindex(columns=columns).to_csv(tmp, mode='a', header=False, index=False)
+
+        for fp in tqdm(full_paths):
+            for chunk in pd.read_csv(fp, chunksize=chunksize, dtype={'tweet_id': str}):
+                ids, valid = parse_tweet_ids(chunk['tweet_id'])
+                keep = ~valid  # Rows without a valid tweet id are kept as they are
+                keep[valid] = seen.add_new(ids[valid])
+
+                rows += len(chunk)
+                duplicates += len(chunk) - keep.sum()
+                chunk[keep].reindex(columns=columns).to_csv(tmp, mode='a', header=False, index=False)
 
-    df = pd.read_csv(full_paths[0])
-    for fp in tqdm(full_paths[1:]):
-        df = pd.concat([df, pd.read_csv(fp)], ignore_index=True)
+        os.replace(tmp, output_fp)
+        if index:
+            seen.save()
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
 
-    l = len(df)
-    df = df.drop_duplicates(subset=['tweet_id'])
-    print(f'Dropped {l - len(df)} duplicates')
-    df.to_csv(os.path.join(input_, output), index=False)
+    print(f'Dropped {duplicates} duplicates')
+    print(f'{rows - duplicates} tweets written to {output_fp}')
 
     print('COMBINED CSV FILES:')
     for fp in full_paths:
@@ -42,10 +89,16 @@ if __name__ == "__main__":
     parser.add_argument('--input', '--i', type=str, help='Directory', required=True)
     parser.add_argument('--output', '--o', type=str, help='Final file name (Default: combined.csv)',
                         default='combined.csv')
+    parser.add_argument('--chunksize', '--cz', type=int, help='Rows read at a time (Default: 100000)',
+                        default=100_000)
+    parser.add_argument('--index', '--ix', type=str, default=None,
+                        help='.npy file of the tweet ids already combined, read and updated to deduplicate across runs')
 
     args = parser.parse_args()
 
     input_ = args.input
     output = args.output
+    chunksize = args.chunksize
+    index = args.index
 
     main()
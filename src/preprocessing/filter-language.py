@@ -1,5 +1,8 @@
 """
 Filter the raw data to only keep tweets in specified languages.
+
+Only the lang column is read to find the tweets to remove, files without any are left untouched. The others are
+streamed chunk by chunk to a temporary file that replaces them once complete, so a crash never leaves a truncated file.
 """
 
 # -------------------------------------------------- IMPORTS -------------------------------------------------- #
@@ -9,6 +12,9 @@ import pandas as pd
 import os
 import argparse
 
+# Local
+from utils import read_table, write_table, file_format, columns_of, list_tables
+
 # -------------------------------------------------- GLOBALS -------------------------------------------------- #
 
 LANGUAGES = ['en', 'es', 'fr', 'it', 'de']
@@ -17,16 +23,39 @@ LANGUAGES = ['en', 'es', 'fr', 'it', 'de']
 # ------------------------------------------------- FUNCTIONS ------------------------------------------------- #
 
 
+def filter_frame(df):
+    return df[df['lang'].isin(languages)].copy()  # Not a view, later stages of the pipeline modify it
+
+
+def filter_csv(fp):
+    """
+    Rewrite a CSV file without the tweets in other languages, values are written as read.
+    """
+    tmp = f'{fp}.tmp'
+    try:
+        header = True
+        for chunk in pd.read_csv(fp, dtype=str, chunksize=chunksize):
+            filter_frame(chunk).to_csv(tmp, mode='w' if header else 'a', header=header, index=False)
+            header = False
+        os.replace(tmp, fp)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
 def process_file(fp):
-    df = pd.read_csv(fp)
-
-    if 'lang' in df.columns:
-        l = len(df)
-        df = df[df['lang'].isin(languages)]
-        df.to_csv(fp, index=False)
-        print(f'Cleaned {os.path.basename(fp)}, {l - len(df)} tweets removed')
-    else:
+    if 'lang' not in columns_of(fp):
         print(f'No language column (lang) in {os.path.basename(fp)}')
+        return
+
+    lang = read_table(fp, columns=['lang'], dtype=str)['lang']
+    removed = (~lang.isin(languages)).sum()
+    if removed:
+        if file_format(fp) == 'csv':
+            filter_csv(fp)
+        else:
+            write_table(filter_frame(read_table(fp)), fp)
+    print(f'Cleaned {os.path.basename(fp)}, {removed} tweets removed')
 
 
 # -------------------------------------------------- MAIN -------------------------------------------------- #
@@ -35,28 +64,25 @@ def process_file(fp):
 def main():
     print('Filtering data...')
 
-    if os.path.isfile(input_):
-        process_file(input_)
-    else:
-        for root, dirs, files in os.walk(input_):
-            for file in files:
-                if file.endswith(".csv"):
-                    fp = os.path.join(root, file)
-                    process_file(fp)
+    for fp in list_tables(input_):
+        process_file(fp)
 
 
 # -------------------------------------------------- CLI -------------------------------------------------- #
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Filter the raw data to only keep tweets in specified languages.')
-    parser.add_argument('--input', '--i', type=str, help='Directory containing the raw data, or CSV File',
-                        required=True)
+    parser.add_argument('--input', '--i', type=str, help='Directory containing the raw data, or file (CSV, Parquet or '
+                                                         'Feather)', required=True)
     parser.add_argument('--languages', '--l', type=str, nargs='+', help='Languages to keep', default=LANGUAGES,
                         required=False)
+    parser.add_argument('--chunksize', '--cz', type=int, help='Rows rewritten at a time (Default: 100000)',
+                        default=100_000)
 
     args = parser.parse_args()
 
     input_ = args.input
     languages = args.languages
+    chunksize = args.chunksize
 
     main()
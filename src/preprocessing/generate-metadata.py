@@ -1,6 +1,10 @@
 """
 Generate metadata for a CSV file.
 Metadata will be the raw dataset without the text column.
+
+The text column is never parsed: only the other columns are read (usecols for CSV, column projection for Parquet and
+Feather), CSV files chunk by chunk so memory does not grow with the size of the file. A directory is processed file
+by file, in parallel with --workers.
 """
 
 # -------------------------------------------------- IMPORTS -------------------------------------------------- #
@@ -8,6 +12,68 @@ Metadata will be the raw dataset without the text column.
 # External
 import pandas as pd
 import argparse
+import os
+from multiprocessing import Pool
+from tqdm import tqdm
+
+# Local
+from utils import read_table, write_table, file_format, columns_of, list_tables
+
+# ------------------------------------------------- CONSTANTS ------------------------------------------------- #
+
+SUFFIX = '_metadata'
+
+
+# ------------------------------------------------- FUNCTIONS ------------------------------------------------- #
+
+def set_options(args):
+    """
+    Set the options from the parsed arguments, in the main process and in every worker.
+    """
+    global options, input_, chunksize
+    options = args
+    input_ = args.input
+    chunksize = args.chunksize
+
+
+def metadata_csv(fp, columns, out):
+    """
+    Stream the columns of a CSV file to out through a temporary file, values are written as read.
+    Returns the number of rows.
+    """
+    tmp = f'{out}.tmp'
+    rows = 0
+    try:
+        pd.DataFrame(columns=columns).to_csv(tmp, index=False)
+        for chunk in pd.read_csv(fp, usecols=columns, dtype=str, chunksize=chunksize):
+            chunk[columns].to_csv(tmp, mode='a', header=False, index=False)
+            rows += len(chunk)
+        os.replace(tmp, out)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return rows
+
+
+def process_file(fp):
+    """
+    Generate the metadata of a file, next to it and in the same format.
+    Returns the file, the number of rows written and the error if any, errors are caught so that one bad file does not
+    stop the others.
+    """
+    try:
+        stem, ext = os.path.splitext(fp)
+        out = f'{stem}{SUFFIX}{ext}'
+        columns = [c for c in columns_of(fp) if c != 'text']
+        if file_format(fp) == 'csv':
+            rows = metadata_csv(fp, columns, out)
+        else:
+            df = read_table(fp, columns=columns)
+            write_table(df, out)
+            rows = len(df)
+        return fp, rows, None
+    except Exception as e:
+        return fp, 0, f'{type(e).__name__}: {e}'
 
 
 # ------------------------------------------------- MAIN ------------------------------------------------- #
@@ -15,20 +81,36 @@ import argparse
 def main():
     print('Generating metadata...')
 
-    df = pd.read_csv(input_)
-    df = df.drop(columns=['text'])
-    df.to_csv(f'{input_[:-4]}_metadata.csv', index=False)
-    print(f'Metadata generated for {input_}')
+    files = list_tables(input_)
+    if os.path.isdir(input_):
+        files = [fp for fp in files if not os.path.splitext(fp)[0].endswith(SUFFIX)]  # Not a previous output
+
+    if workers > 1:  # Files are independent, each worker processes whole files
+        with Pool(workers, initializer=set_options, initargs=(options,)) as pool:
+            results = list(tqdm(pool.imap_unordered(process_file, files), total=len(files)))
+    else:
+        results = [process_file(fp) for fp in files]
+
+    for fp, rows, error in sorted(results):
+        if error:
+            print(f'Failed {fp}: {error}')
+        else:
+            print(f'Metadata generated for {fp}')
+    print(f'{len(results)} files, {sum(rows for _, rows, _ in results)} tweets')
 
 
 # -------------------------------------------------- CLI -------------------------------------------------- #
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Generate metadata for a CSV file.')
-    parser.add_argument('--input', '--i', type=str, help='CSV file', required=True)
+    parser.add_argument('--input', '--i', type=str, help='Directory or file (CSV, Parquet or Feather)', required=True)
+    parser.add_argument('--chunksize', '--cz', type=int, help='Rows read at a time (Default: 100000)',
+                        default=100_000)
+    parser.add_argument('--workers', '--w', type=int, help='Number of worker processes (Default: 1)', default=1)
 
     args = parser.parse_args()
 
-    input_ = args.input
+    set_options(args)
+    workers = args.workers
 
     main()
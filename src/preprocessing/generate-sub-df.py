@@ -1,6 +1,10 @@
 """
 Generate sub-datasets for a CSV file.
 Sub-datasets will be grouped by a column and will contain tweet_id and text columns.
+
+The file is scanned once, chunksize rows at a time, and rows are routed to the file of their group through buffers
+flushed every buffer_size rows, so memory does not grow with the size of the input. Groups are written to a temporary
+directory and only the ones with at least min_size tweets are moved to the output directory.
 """
 
 # -------------------------------------------------- IMPORTS -------------------------------------------------- #
@@ -9,31 +13,88 @@ Sub-datasets will be grouped by a column and will contain tweet_id and text colu
 import pandas as pd
 import argparse
 import os
+import shutil
+import tempfile
+from collections import defaultdict
 
+# Local
+from utils import read_table, file_format
 
-# ------------------------------------------------- MAIN ------------------------------------------------- #
+# ------------------------------------------------- CONSTANTS ------------------------------------------------- #
 
-def main():
-    df = pd.read_csv(input_)
-    df = df[['tweet_id', 'text', group_by]]
+UNIT_FORMATS = {'D': '%Y-%m-%d', 'M': '%Y-%m', 'Y': '%Y'}  # Names of the timestamp groups
+
+
+# ------------------------------------------------- FUNCTIONS ------------------------------------------------- #
+
+def group_keys(chunk):
+    """
+    Group of every row of a chunk as a string, the name of its sub-dataset (NaN if the row has no group).
+    """
     if group_by == 'timestamp':
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        if unit == 'D':
-            df['timestamp'] = df['timestamp'].dt.date
-        elif unit == 'M':
-            df['timestamp'] = df['timestamp'].dt.to_period('M')
-        elif unit == 'Y':
-            df['timestamp'] = df['timestamp'].dt.to_period('Y')
-    df = df.groupby(group_by)
+        return pd.to_datetime(chunk['timestamp']).dt.strftime(UNIT_FORMATS[unit])
+    return chunk[group_by]
+
+
+def flush(buffers, tmp_dir, written):
+    """
+    Append the buffered rows of every group to its file.
+    """
+    for group, frames in buffers.items():
+        fp = os.path.join(tmp_dir, f'{group}.csv')
+        pd.concat(frames).to_csv(fp, mode='a', header=group not in written, index=False)
+        written.add(group)
+    buffers.clear()
+
 
-    if not os.path.exists(f'{input_[:-4]}_by_{group_by}'):
-        os.makedirs(f'{input_[:-4]}_by_{group_by}')
+def route_chunks(chunks, out_dir):
+    """
+    Route the rows of chunks to the sub-datasets of their group in out_dir, chunks are yielded on unchanged.
+    Groups are written to a temporary directory, the ones with at least min_size tweets are moved to out_dir once all
+    the chunks are routed.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(out_dir)))
+
+    try:
+        counts = defaultdict(int)  # Tweets per group
+        buffers = defaultdict(list)  # Rows of every group not written yet
+        buffered = 0
+        written = set()  # Groups with a file in tmp_dir
+        for chunk in chunks:
+            keys = group_keys(chunk)
+            rows = chunk[['tweet_id', 'text']][keys.notna()]
+            for group, group_rows in rows.groupby(keys[keys.notna()], sort=False):
+                buffers[group].append(group_rows)
+                counts[group] += len(group_rows)
+
+            buffered += len(rows)
+            if buffered >= buffer_size:
+                flush(buffers, tmp_dir, written)
+                buffered = 0
+            yield chunk
+        flush(buffers, tmp_dir, written)
+
+        for group in sorted(counts):
+            if counts[group] < min_size:
+                continue
+            shutil.move(os.path.join(tmp_dir, f'{group}.csv'), os.path.join(out_dir, f'{group}.csv'))
+            print(f'Sub-dataset generated for {group_by} = {group}')
+    finally:
+        shutil.rmtree(tmp_dir)  # Groups smaller than min_size
+
+
+# ------------------------------------------------- MAIN ------------------------------------------------- #
+
+def main():
+    columns = ['tweet_id', 'text', group_by]
+    if file_format(input_) == 'csv':
+        chunks = pd.read_csv(input_, usecols=columns, dtype=str, chunksize=chunksize)  # Values written as read
+    else:
+        chunks = [read_table(input_, columns=columns)]
 
-    for group in df.groups:
-        if len(df.get_group(group)) < min_size:
-            continue
-        df.get_group(group).drop(columns=[group_by]).to_csv(f'{input_[:-4]}_by_{group_by}/{group}.csv', index=False)
-        print(f'Sub-dataset generated for {group_by} = {group}')
+    for _ in route_chunks(chunks, f'{os.path.splitext(input_)[0]}_by_{group_by}'):
+        pass
 
 
 # -------------------------------------------------- CLI -------------------------------------------------- #
@@ -47,12 +108,19 @@ if __name__ == '__main__':
                         required=False)
     parser.add_argument('--min-size', '--ms', type=int, help='Minimum size of a sub-dataset', default=100,
                         required=False)
+    parser.add_argument('--chunksize', '--cz', type=int, help='Rows read at a time (Default: 100000)',
+                        default=100_000)
+    parser.add_argument('--buffer-size', '--bf', type=int,
+                        help='Rows buffered in memory before being written to the groups (Default: 1000000)',
+                        default=1_000_000)
 
     args = parser.parse_args()
 
     input_ = args.input
     group_by = args.group_by
     min_size = args.min_size
+    chunksize = args.chunksize
+    buffer_size = args.buffer_size
     if group_by == 'timestamp':
         unit = args.unit
         if unit not in ['D', 'M', 'Y']:
@@ -1,5 +1,9 @@
 """
 Perform data cleaning on the raw linguistic data (tweets).
+
+The class column is appended chunk by chunk to a temporary file that replaces the file once complete. With --metadata
+the class is stored once as file-level metadata instead (sidecar .meta.json file for CSV, schema metadata for Parquet
+and Feather), CSV files are then not rewritten at all.
 """
 
 # -------------------------------------------------- IMPORTS -------------------------------------------------- #
@@ -9,13 +13,38 @@ import pandas as pd
 import argparse
 import os
 
+# Local
+from utils import read_table, write_table, file_format, write_metadata, list_tables
+
 
 # ------------------------------------------------- FUNCTIONS ------------------------------------------------- #
 
+def label_csv(fp):
+    """
+    Rewrite a CSV file with the class column, values are written as read.
+    """
+    tmp = f'{fp}.tmp'
+    try:
+        header = True
+        for chunk in pd.read_csv(fp, dtype=str, chunksize=chunksize):
+            chunk['class'] = class_
+            chunk.to_csv(tmp, mode='w' if header else 'a', header=header, index=False)
+            header = False
+        os.replace(tmp, fp)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
 def process_file(fp):
-    df = pd.read_csv(fp)
-    df['class'] = class_
-    df.to_csv(fp, index=False)
+    if metadata:
+        write_metadata(fp, {'class': class_})
+    elif file_format(fp) == 'csv':
+        label_csv(fp)
+    else:
+        df = read_table(fp)
+        df['class'] = class_
+        write_table(df, fp)
     print(f'Labelled {fp}')
 
 
@@ -24,27 +53,26 @@ def process_file(fp):
 def main():
     print('Labelling data...')
 
-    if os.path.isfile(input_):
-        process_file(input_)
-    else:
-
-        for root, dirs, files in os.walk(input_):
-            for file in files:
-                if file.endswith(".csv"):
-                    fp = os.path.join(root, file)
-                    process_file(fp)
+    for fp in list_tables(input_):
+        process_file(fp)
 
 
 # -------------------------------------------------- CLI -------------------------------------------------- #
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Perform data cleaning on the raw linguistic data.')
-    parser.add_argument('--input', '--i', type=str, help='Directory or CSV file', required=True)
+    parser.add_argument('--input', '--i', type=str, help='Directory or file (CSV, Parquet or Feather)', required=True)
     parser.add_argument('--class_', '--c', type=str, help='Class to labelled the data', required=True)
+    parser.add_argument('--metadata', '--md', action=argparse.BooleanOptionalAction,
+                        help='Store the class as file metadata instead of a column (Default: False)', default=False)
+    parser.add_argument('--chunksize', '--cz', type=int, help='Rows rewritten at a time (Default: 100000)',
+                        default=100_000)
 
     args = parser.parse_args()
 
     input_ = args.input
     class_ = args.class_
+    metadata = args.metadata
+    chunksize = args.chunksize
 
     main()
@@ -0,0 +1,150 @@
+"""
+Helpers shared by the preprocessing scripts.
+"""
+
+# ----------------------------------------------- IMPORTS ----------------------------------------------- #
+
+# External
+import os
+import re
+import sys
+import numpy as np
+import pandas as pd
+
+# Local
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # src, shared by the toolbox
+from storage import read_table, write_table, file_format, with_format, columns_of, write_metadata, list_tables, \
+    has_lone_cr
+
+
+# ---------------------------------------------- FUNCTIONS ---------------------------------------------- #
+
+
+def char_class(code_points):
+    """
+    Regex character class matching the given code points, consecutive code points are merged into ranges so the
+    class stays small however many characters it holds.
+    """
+    ranges = []
+    for c in sorted(set(code_points)):
+        if ranges and c == ranges[-1][1] + 1:
+            ranges[-1][1] = c
+        else:
+            ranges.append([c, c])
+
+    return '[' + ''.join(re.escape(chr(a)) if a == b else f'{re.escape(chr(a))}-{re.escape(chr(b))}'
+                         for a, b in ranges) + ']'
+
+
+def alternation(strings):
+    """
+    Regex matching any of the strings, the longest one where several match. Strings are merged into a trie so the
+    regex tests one branch per character instead of every string, branches ending a string merge into a character
+    class (see char_class).
+    """
+    trie = {}
+    for s in strings:
+        node = trie
+        for c in s:
+            node = node.setdefault(c, {})
+        node[''] = {}  # End of a string
+
+    def pattern(node):
+        leaves = [c for c, child in node.items() if c and child == {'': {}}]
+        branches = [re.escape(c) + pattern(child) for c, child in sorted(node.items()) if c and c not in leaves]
+        if leaves:
+            branches.append(char_class(ord(c) for c in leaves))
+        if not branches:
+            return ''
+        group = f'(?:{"|".join(branches)})'
+        return group + '?' if '' in node else group  # Greedy, a longer string is tried first
+
+    return pattern(trie)
+
+
+def parse_tweet_ids(tweet_ids):
+    """
+    Tweet ids of a Series of strings as int64 and the mask of the valid ones. Ids are parsed from their text so that
+    they never go through float64, tweet ids have more digits than a float64 holds. Ids beyond int64 are invalid.
+    """
+    max_id = str(np.iinfo(np.int64).max)
+    digits = tweet_ids.str.fullmatch(r'\d{1,19}').fillna(False)
+    in_range = (tweet_ids.str.len() < len(max_id)) | (tweet_ids <= max_id)  # Same number of digits, compared as text
+    valid = (digits & in_range.fillna(False)).to_numpy()
+    ids = np.zeros(len(tweet_ids), dtype=np.int64)
+    ids[valid] = tweet_ids[valid].astype(np.int64)
+    return ids, valid
+
+
+# ----------------------------------------------- CLASSES ----------------------------------------------- #
+
+
+class TweetIdSet:
+    """
+    Set of tweet ids held in sorted int64 arrays, 8 bytes per id where a Python set of ints takes about 70.
+    Ids are added by batches, each batch becomes a sorted run and runs of similar sizes are merged (as in a binary
+    counter), so there are O(log n) runs to search and every id is copied O(log n) times.
+    The set can be saved to and loaded from a .npy file to deduplicate across runs.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.runs = []  # Sorted arrays of decreasing sizes
+        if path and os.path.exists(path):
+            self.insert(np.load(path))
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs)
+
+    def contains(self, ids):
+        """
+        Mask of the ids in the set.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(ids)
+        ids = ids[order]  # Sorted queries walk the runs in order, far fewer cache misses on large runs
+        found = np.zeros(len(ids), dtype=bool)
+        for run in self.runs:
+            pos = np.searchsorted(run, ids).clip(max=len(run) - 1)
+            found |= run[pos] == ids
+
+        mask = np.empty(len(ids), dtype=bool)
+        mask[order] = found
+        return mask
+
+    def add(self, ids):
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        self.insert(ids[~self.contains(ids)])
+
+    def insert(self, ids):
+        """
+        Insert sorted ids, none of them already in the set, as a new run.
+        """
+        if not len(ids):
+            return
+
+        self.runs.append(ids)
+        while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+            last = self.runs.pop()
+            self.runs[-1] = np.sort(np.concatenate([self.runs[-1], last]), kind='mergesort')  # Merge of sorted runs
+
+    def add_new(self, ids):
+        """
+        Add ids to the set, returns the mask of the ids that were not in it yet (first occurrence of each).
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        new = ~self.contains(ids) & ~pd.Series(ids).duplicated().to_numpy()
+        self.insert(np.sort(ids[new]))
+        return new
+
+    def save(self, path=None):
+        """
+        Write the set to a .npy file as a single sorted array, through a temporary file.
+        """
+        path = path or self.path
+        ids = np.sort(np.concatenate(self.runs), kind='mergesort') if self.runs else np.empty(0, dtype=np.int64)
+        self.runs = [ids] if len(ids) else []
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, ids)
+        os.replace(tmp, path)
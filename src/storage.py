@@ -0,0 +1,239 @@
+"""
+Storage of the tweet tables shared by the toolbox: CSV, Parquet or Feather (Arrow IPC), chosen by the file extension.
+
+Columnar files keep the types of the columns, so they are not parsed and inferred again at every stage, and are read
+column by column. Tables written to them follow SCHEMA (int64 ids, UTC timestamps, categorical language). CSV files
+are read and written as before, for compatibility with the data acquisition scripts and existing data.
+
+Files can be converted from one format to another:
+
+    python src/storage.py --input data/covid-github --format parquet
+"""
+
+# ----------------------------------------------- IMPORTS ----------------------------------------------- #
+
+# External
+import argparse
+import json
+import os
+import re
+import pandas as pd
+
+# ---------------------------------------------- CONSTANTS ---------------------------------------------- #
+
+FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather'}
+
+# Types of the tweet columns in columnar files, columns that cannot be converted are kept as they are
+SCHEMA = {
+    'tweet_id': 'int64',
+    'user_id': 'int64',
+    'timestamp': 'datetime64[ns, UTC]',
+    'lang': 'category',
+}
+
+METADATA_KEY = b'twitter_toolbox'  # Key of the file-level metadata in the schema of columnar files
+ENTITY_SUFFIX = '_entities.parquet'  # Entity tables written by namedEntity next to the tweet tables
+
+
+# ---------------------------------------------- FUNCTIONS ---------------------------------------------- #
+
+
+def file_format(fp):
+    """
+    Format of a file from its extension, None if it is not a table.
+    """
+    ext = os.path.splitext(fp)[1].lower()
+    return next((fmt for fmt, e in FORMATS.items() if e == ext), None)
+
+
+def is_table(fp):
+    """
+    Whether fp is a tweet table, the entity tables of namedEntity (<file>_entities.parquet) are not.
+    """
+    return file_format(fp) is not None and not fp.endswith(ENTITY_SUFFIX)
+
+
+def with_format(fp, fmt):
+    """
+    Path of fp with the extension of fmt.
+    """
+    return os.path.splitext(fp)[0] + FORMATS[fmt]
+
+
+def has_lone_cr(fp, block_size=1 << 20):
+    """
+    Whether a file holds a carriage return not followed by a line feed, the file is read by blocks.
+    Tweets with such a character break the default parser, these files are parsed with a line feed line terminator.
+    """
+    with open(fp, 'rb') as f:
+        previous = b''
+        while block := f.read(block_size):
+            block = previous + block
+            if re.search(b'\r[^\n]', block):  # A carriage return ending the block is checked with the next one
+                return True
+            previous = block[-1:]
+        return previous == b'\r'
+
+
+def apply_schema(df):
+    for column, dtype in SCHEMA.items():
+        if column in df.columns and df[column].dtype != dtype:
+            try:
+                if dtype.startswith('datetime'):
+                    df[column] = pd.to_datetime(df[column], utc=True)
+                else:
+                    df[column] = df[column].astype(dtype)
+            except (ValueError, TypeError, OverflowError):
+                print(f'Column {column} kept as {df[column].dtype}, it cannot be converted to {dtype}')
+    return df
+
+
+def arrow_schema(fp):
+    """
+    Schema of a columnar file, without reading its rows.
+    """
+    if file_format(fp) == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_schema(fp)
+    import pyarrow as pa
+    with pa.memory_map(fp) as source:
+        return pa.ipc.open_file(source).schema
+
+
+def columns_of(fp):
+    """
+    Columns of a table, without reading its rows.
+    """
+    if file_format(fp) == 'csv':
+        return pd.read_csv(fp, nrows=0).columns.tolist()
+    return arrow_schema(fp).names
+
+
+def read_table(fp, columns=None, **kwargs):
+    """
+    Read a table, only the given columns if any (columns missing from the file are ignored).
+    kwargs are passed to pd.read_csv for CSV files.
+    """
+    fmt = file_format(fp)
+    if columns is not None:
+        columns = [c for c in columns_of(fp) if c in columns]
+
+    if fmt == 'parquet':
+        return pd.read_parquet(fp, columns=columns)
+    if fmt == 'feather':
+        return pd.read_feather(fp, columns=columns)
+    return pd.read_csv(fp, usecols=columns, **kwargs)
+
+
+def write_table(df, fp):
+    """
+    Write a table in the format of its extension, through a temporary file for columnar formats.
+    """
+    fmt = file_format(fp)
+    if fmt == 'csv':
+        df.to_csv(fp, index=False)
+        return
+
+    import pyarrow as pa
+    metadata = read_metadata(fp) if os.path.exists(fp) else {}  # Kept when a table is rewritten
+    write_arrow(pa.Table.from_pandas(apply_schema(df.reset_index(drop=True)), preserve_index=False), fp, metadata)
+
+
+def write_arrow(table, fp, metadata=None):
+    """
+    Write a pyarrow table to a columnar file with its metadata if any, through a temporary file.
+    """
+    import pyarrow.parquet as pq
+    import pyarrow.feather as pf
+    if metadata:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), METADATA_KEY: json.dumps(metadata)})
+
+    tmp = f'{fp}.tmp'
+    if file_format(fp) == 'parquet':
+        pq.write_table(table, tmp)
+    else:
+        pf.write_feather(table, tmp)
+    os.replace(tmp, fp)
+
+
+def metadata_path(fp):
+    """
+    Sidecar JSON file holding the metadata of a CSV file, CSV has no place for it.
+    """
+    return f'{fp}.meta.json'
+
+
+def read_metadata(fp):
+    """
+    File-level metadata of a table (e.g. a label shared by all its tweets), as a dict.
+    """
+    if file_format(fp) == 'csv':
+        if not os.path.exists(metadata_path(fp)):
+            return {}
+        with open(metadata_path(fp)) as f:
+            return json.load(f)
+
+    return json.loads((arrow_schema(fp).metadata or {}).get(METADATA_KEY, b'{}'))
+
+
+def write_metadata(fp, metadata):
+    """
+    Add metadata to a table, through a temporary file. The rows of a CSV file are not rewritten, the metadata goes
+    to its sidecar file, columnar files are rewritten without converting their columns.
+    """
+    fmt = file_format(fp)
+    metadata = {**read_metadata(fp), **metadata}
+    if fmt == 'csv':
+        tmp = f'{metadata_path(fp)}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(metadata, f)
+        os.replace(tmp, metadata_path(fp))
+        return
+
+    import pyarrow.parquet as pq
+    import pyarrow.feather as pf
+    write_arrow(pq.read_table(fp) if fmt == 'parquet' else pf.read_table(fp), fp, metadata)
+
+
+def list_tables(input_):
+    """
+    Tweet tables to process (see is_table), input_ is either a table or a directory walked recursively.
+    """
+    if os.path.isfile(input_):  # Single file
+        return [input_]
+
+    return [os.path.join(root, file) for root, dirs, files in os.walk(input_) for file in files if is_table(file)]
+
+
+# ------------------------------------------------- MAIN ------------------------------------------------- #
+
+
+def main():
+    for fp in list_tables(input_):
+        if file_format(fp) == fmt:
+            continue
+
+        out = with_format(fp, fmt)
+        write_table(read_table(fp), out)
+        print(f'{fp} -> {out}')
+        if delete:
+            os.remove(fp)
+
+
+# -------------------------------------------------- CLI -------------------------------------------------- #
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert tweet tables between CSV, Parquet and Feather.')
+
+    parser.add_argument('--input', '--i', type=str, help='Directory or file', required=True)
+    parser.add_argument('--format', '--f', type=str, choices=list(FORMATS), help='Target format', required=True)
+    parser.add_argument('--delete', '--d', action=argparse.BooleanOptionalAction,
+                        help='Delete the converted files (Default: False)', default=False)
+
+    args = parser.parse_args()
+    input_ = args.input
+    fmt = args.format
+    delete = args.delete
+
+    main()